@@ -40,6 +40,8 @@ _land_types = [
 
 
 class A0_landArtist(BaseArtist):
+    preview = True
+
     def __init__(self):
         super().__init__(_land_types)
 
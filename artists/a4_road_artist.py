@@ -1,10 +1,13 @@
 from collections import namedtuple, defaultdict
+from typing import List
 from weakref import WeakKeyDictionary
 from xml.etree.ElementTree import Element
 
+import numpy as np
 from PIL.ImageDraw import ImageDraw
 
-from base_artist import explode_features, transform_shapes, element_to_lines, element_to_polygons, MappedFeature
+from base_artist import explode_features, simplify_shapes, element_to_simplified_lines, MappedFeature, clip_lines, \
+    ZOOM_CAMERAS
 from camera import Camera
 from location_filter import Rectangle
 from osm_helper import OsmHelper, tag_dict
@@ -41,25 +44,53 @@ _road_types = explode_features([
 ])
 
 
+_ZOOM_PPM = np.array([camera.px_per_meter() for camera in ZOOM_CAMERAS])
+
+
+def _is_area(tags: dict):
+    return tags.get('area') == 'yes' and not tags.get('railway') == 'turntable'
+
+
 class A4_roadArtist:
+    styles = _road_types
+    preview = True
+
     def __init__(self):
         self.types = WeakKeyDictionary()
 
-    def wants_element(self, element: Element, osm_helper: OsmHelper):
-        tags = tag_dict(element)
-        if tags.get('area') == 'yes' and \
-                not tags.get('railway') == 'turntable':
-            return False
-        for tag, types in _road_types.items():
+    def match(self, tags: dict):
+        if _is_area(tags):
+            return None
+        for tag, types in self.styles.items():
             try:
-                self.types[element] = types[tags[tag]]
-                return True
+                return types[tags[tag]]
             except KeyError:
                 pass
-        return False
+        return None
+
+    def wants_element(self, element: Element, osm_helper: OsmHelper):
+        tags = tag_dict(element)
+        return self.accept_element(element, self.match(tags), tags, osm_helper)
+
+    def accept_element(self, element: Element, road_type: MappedFeature, tags: dict, osm_helper: OsmHelper):
+        if road_type is None or _is_area(tags):
+            return False
+        self.types[element] = road_type
+        return True
+
+    def export_element(self, element: Element):
+        return ()
+
+    def import_element(self, element: Element, state, osm_helper: OsmHelper):
+        self.types[element] = self.match(tag_dict(element))
 
     def draws_at_zoom(self, element: Element, zoom: int, osm_helper: OsmHelper):
-        return Camera(zoom_level=zoom).px_per_meter() >= self.types[element].style.min_ppm
+        return bool(self.zoom_masks([element], osm_helper)[0] >> zoom & 1)
+
+    def zoom_masks(self, elements: List[Element], osm_helper: OsmHelper):
+        min_ppm = np.array([self.types[element].style.min_ppm for element in elements], dtype=np.float64)
+        draws = _ZOOM_PPM >= min_ppm[:, None]
+        return (draws.astype(np.uint32) << np.arange(len(_ZOOM_PPM), dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
 
     def draw(self, elements: Element, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
         layers = defaultdict(lambda: defaultdict(list))
@@ -72,11 +103,15 @@ class A4_roadArtist:
                     else -1 if tags.get('tunnel') == 'yes'\
                     else 0
             road_type: MappedFeature = self.types[element]
-            layers[layer][road_type] += transform_shapes(element_to_lines(element, osm_helper), camera)
+            layers[layer][road_type] += element_to_simplified_lines(element, osm_helper)
+
+        for roads in layers.values():
+            for road_type in roads:
+                roads[road_type] = simplify_shapes(roads[road_type], camera)
 
         def draw_roads(color, width, roads):
             if color is not None:
-                for road in roads:
+                for road in clip_lines(roads, camera, width):
                     image_draw.line(road, fill=color, width=width, joint='curve')
 
         for layer in range(-5, 7):
@@ -5,9 +5,9 @@ from xml.etree.ElementTree import Element
 
 from PIL.ImageDraw import ImageDraw
 
-from base_artist import BaseArtist, element_to_polygons, FontItalic, BaseStyle, Feature, MappedFeature
+from base_artist import BaseArtist, element_has_polygons, element_to_label_point, elements_to_label_points, \
+    FontItalic, BaseStyle, Feature, in_viewport, LABEL_MARGIN
 from camera import Camera
-from geometry import polygon_centroid, polygon_area
 from osm_helper import OsmHelper
 
 _KEY = 'addr:housenumber'
@@ -20,37 +20,34 @@ class StyleAddress(BaseStyle):
     fill: str
     min_ppm: float
 
+    def wants_element(self, element: Element, tags: dict, osm_helper: OsmHelper):
+        return element.tag == 'node' or element_has_polygons(element, osm_helper)
+
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
-        if element.tag == 'node':
-            return (float(element.attrib['lat']), float(element.attrib['lon'])), tags[self.key]
-        else:
-            polygons = [(polygon, polygon_area(polygon)) for polygon in element_to_polygons(element, osm_helper)]
-            if len(polygons) > 0:
-                polygon, area = max(polygons, key=itemgetter(1))
-                return polygon_centroid(polygon), tags[self.key]
-
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
+        point = element_to_label_point(element, osm_helper)
+        if point is not None:
+            return point, tags[self.key]
+
+    def convert_many(self, elements: List[Element], tags: List[dict], osm_helper: OsmHelper):
+        return [None if point is None else (point, element_tags[self.key])
+                for point, element_tags in zip(elements_to_label_points(elements, osm_helper), tags)]
+
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
         return camera.px_per_meter() >= self.min_ppm
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
-        for point, text in sorted(features, key=itemgetter(1)):
-            x, y = camera.gps_to_px(point)
+        features = sorted(features, key=itemgetter(1))
+        points = camera.gps_to_px_array([point for point, text in features]).tolist()
+        for (x, y), (point, text) in zip(points, features):
+            if not in_viewport((x, y), camera, LABEL_MARGIN):
+                continue
             width, height = image_draw.textsize(text, font=self.font)
             image_draw.text((x - width // 2, y - height // 2), text=text, fill=self.fill, font=self.font)
 
-    # BaseArtist hack
-    def items(self):
-        return [(self.key, self)]
-
-    # BaseArtist hack
-    def __getitem__(self, item):
-        return MappedFeature(0, self)
-
 
 class A6_addressArtist(BaseArtist):
     def __init__(self):
-        super().__init__([])
-        self.styles = StyleAddress('addr:housenumber', FontItalic(10), '#aaa', 2)
+        super().__init__([Feature(_KEY, None, StyleAddress(_KEY, FontItalic(10), '#aaa', 2))])
 
     def __str__(self):
         return "Addresses"
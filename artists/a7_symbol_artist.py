@@ -5,9 +5,9 @@ from xml.etree.ElementTree import Element
 
 from PIL.ImageDraw import ImageDraw
 
-from base_artist import BaseArtist, BaseStyle, Feature, FontSymbol, FontEmoji, element_to_polygons, element_to_area_m
+from base_artist import BaseArtist, BaseStyle, Feature, FontSymbol, FontEmoji, element_has_polygons, \
+    element_to_area_m, element_to_label_point, elements_to_label_points, in_viewport, LABEL_MARGIN
 from camera import Camera
-from geometry import polygon_centroid, polygon_area
 from osm_helper import OsmHelper
 
 _pil_workaround = False
@@ -29,22 +29,33 @@ class StyleSymbol(BaseStyle):
         else:
             return self.text
 
+    def wants_element(self, element: Element, tags: dict, osm_helper: OsmHelper):
+        return element.tag == 'node' or element_has_polygons(element, osm_helper)
+
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
+        return self._feature(element, element_to_label_point(element, osm_helper), osm_helper)
+
+    def convert_many(self, elements: List[Element], tags: List[dict], osm_helper: OsmHelper):
+        return [self._feature(element, point, osm_helper)
+                for element, point in zip(elements, elements_to_label_points(elements, osm_helper))]
+
+    @staticmethod
+    def _feature(element: Element, point, osm_helper: OsmHelper):
         if element.tag == 'node':
-            return (float(element.attrib['lat']), float(element.attrib['lon'])), 0
-        else:
-            polygons = [(polygon, polygon_area(polygon)) for polygon in element_to_polygons(element, osm_helper)]
-            if len(polygons) > 0:
-                polygon, area = max(polygons, key=itemgetter(1))
-                return polygon_centroid(polygon), element_to_area_m(element, osm_helper)
+            return point, 0
+        if point is not None:
+            return point, element_to_area_m(element, osm_helper)
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
-        point, area = feature
-        return camera.px_per_meter() >= self.min_ppm or area * (camera.px_per_meter() ** 2) >= self.min_area
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
+        # | rather than or, the area may be an array of areas
+        return (camera.px_per_meter() >= self.min_ppm) | (area * (camera.px_per_meter() ** 2) >= self.min_area)
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
-        for point, area in sorted(features, key=itemgetter(1)):
-            x, y = camera.gps_to_px(point)
+        features = sorted(features, key=itemgetter(1))
+        points = camera.gps_to_px_array([point for point, area in features]).tolist()
+        for (x, y), (point, area) in zip(points, features):
+            if not in_viewport((x, y), camera, LABEL_MARGIN):
+                continue
             width, height = image_draw.textsize(self._text, font=self.font)
             image_draw.text((x - width // 2, y - height // 2), text=self._text, fill=self.fill, font=self.font)
 
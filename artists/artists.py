@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 
 files = [
     'a0_land_artist',
@@ -19,3 +21,30 @@ def get_artists():
                                         dir(module)))
         artists += module_artists
     return artists
+
+
+class ArtistDispatch:
+    def __init__(self, artists: list):
+        # key -> value -> [(artist index, key rank, feature)], rank keeps the key priority of BaseArtist.match
+        self.values = defaultdict(lambda: defaultdict(list))
+        self.wildcards = defaultdict(list)
+        self.artists = artists
+        for i, artist in enumerate(artists):
+            for rank, (key, features) in enumerate(artist.styles.items()):
+                for value, feature in features.items():
+                    self.values[key][value].append((i, rank, feature))
+                if isinstance(features, defaultdict):
+                    self.wildcards[key].append((i, rank, features.default_factory()))
+        self.values = {key: dict(values) for key, values in self.values.items()}
+        self.wildcards = dict(self.wildcards)
+
+    def classify(self, tags: dict):
+        best = {}
+        for key, value in tags.items():
+            values = self.values.get(key)
+            exact = values.get(value, ()) if values is not None else ()
+            for candidates in (exact, self.wildcards.get(key, ())):
+                for i, rank, feature in candidates:
+                    if i not in best or rank < best[i][0]:
+                        best[i] = rank, feature
+        return [(self.artists[i], best[i][1]) for i in sorted(best)]
@@ -5,13 +5,16 @@ from typing import List, Tuple, Union, Any
 from weakref import WeakKeyDictionary
 from xml.etree.ElementTree import Element
 
+import numpy as np
 from PIL import ImageFont
 from PIL.ImageDraw import ImageDraw
 
-from camera import Camera
-from geometry import polygon_area
+from camera import Camera, MAX_ZOOM_LEVEL, gps_to_mercator
+from geometry import polygon_area, points_in_polygon, polygons_area, polygons_bbox, polygons_centroid, \
+    polygons_convex, simplification_tolerances, clip_polygon, clip_polyline
 from location_filter import Rectangle
 from osm_helper import OsmHelper, tag_dict
+from polylabel import polylabel
 
 
 def nulano_log(*message, level, **kwargs):
@@ -23,23 +26,183 @@ def nulano_warn_font():
 
 
 def transform_shapes(shapes: List[List[Tuple[float, float]]], camera: Camera):
-    return [[camera.gps_to_px(point) for point in shape] for shape in shapes]
+    # all shapes are projected at once, the result is an array of pixels for each shape
+    if len(shapes) == 0:
+        return []
+    shapes = [np.asarray(shape, dtype=np.float64).reshape(-1, 2) for shape in shapes]
+    return np.split(camera.gps_to_px_array(np.concatenate(shapes)), np.cumsum(list(map(len, shapes[:-1]))))
+
+
+# shapes are clipped to the image grown by this many pixels, so the clipped edges and line caps stay hidden
+_CLIP_MARGIN = 2
+# labels are measured only after their anchor is this close to the image
+LABEL_MARGIN = 128
+
+
+def _viewport(camera: Camera, margin: float):
+    return -margin, -margin, camera.px_width + margin, camera.px_height + margin
+
+
+def in_viewport(point: Tuple[float, float], camera: Camera, margin: float = _CLIP_MARGIN):
+    min_x, min_y, max_x, max_y = _viewport(camera, margin)
+    return min_x <= point[0] <= max_x and min_y <= point[1] <= max_y
+
+
+def clip_polygons(polygons: List[List[Tuple[float, float]]], camera: Camera):
+    # far off-screen coordinates are slow to rasterize and overflow in Pillow
+    rect = _viewport(camera, _CLIP_MARGIN)
+    polygons = [clip_polygon(polygon, rect) for polygon in polygons]
+    return [list(map(tuple, polygon.tolist())) for polygon in polygons if len(polygon) != 0]
+
+
+def clip_lines(lines: List[List[Tuple[float, float]]], camera: Camera, width: float = 0):
+    rect = _viewport(camera, width + _CLIP_MARGIN)
+    return [list(map(tuple, part.tolist())) for line in lines for part in clip_polyline(line, rect)]
+
+
+# a camera for every zoom level, for deciding what is drawn there
+ZOOM_CAMERAS = [Camera(zoom_level=zoom) for zoom in range(MAX_ZOOM_LEVEL + 1)]
+
+# vertices deviating less than this many pixels from the simplified shape are left out
+_SIMPLIFY_PX = 0.5
+_EARTH_CIRCUMFERENCE_M = 40000000
+# the largest deviation left out at each zoom level, in meters
+_SIMPLIFY_TOLERANCES = [_SIMPLIFY_PX / camera.px_per_meter() for camera in ZOOM_CAMERAS]
+# rings smaller than this many pixels at the highest zoom level are labeled at their centroid, even if it is outside
+_LABEL_SMALL_PX = 4
+
+
+class LevelsOfDetail:
+    """A shape projected to Web Mercator once and simplified for every zoom level, the vertices are ranked by
+    the Douglas-Peucker tolerance at which they are left out."""
+    __slots__ = 'points', 'tolerances'
+
+    def __init__(self, shape: List[Tuple[float, float]], ring: bool = False):
+        shape = np.asarray(shape, dtype=np.float64).reshape(-1, 2)
+        self.points = gps_to_mercator(shape)
+        # a unit of Mercator is the length of the parallel, the same scale the camera uses at this latitude
+        scale = _EARTH_CIRCUMFERENCE_M * math.cos(math.radians(shape[0, 0])) if len(shape) != 0 else 1
+        self.tolerances = simplification_tolerances(self.points * scale, _SIMPLIFY_TOLERANCES[-1], ring)
+
+    def at_zoom(self, zoom: int):
+        return self.points[self.tolerances >= _SIMPLIFY_TOLERANCES[zoom]]
+
+
+def simplify_shapes(shapes: List[LevelsOfDetail], camera: Camera):
+    """The shapes simplified for the zoom level of the camera, in pixels."""
+    if len(shapes) == 0:
+        return []
+    shapes = [shape.at_zoom(camera.zoom_level) for shape in shapes]
+    return np.split(camera.mercator_to_px_array(np.concatenate(shapes)), np.cumsum(list(map(len, shapes[:-1]))))
 
 
 def _memoize(func):
-    def memoized(element: Element, osm_helper, cache=WeakKeyDictionary()):
+    cache = WeakKeyDictionary()
+
+    def memoized(element: Element, osm_helper):
         try:
             return cache[element]
         except KeyError:
             cache[element] = out = func(element, osm_helper)
             return out
 
+    # batch versions fill the cache directly
+    memoized.cache = cache
     return memoized
 
 
+def _offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.intp)])
+
+
+def _ways_points(ways: List[Element], osm_helper: OsmHelper):
+    # coordinates of many ways with one node lookup, ways with missing nodes are left out
+    refs = [np.asarray(osm_helper.way_refs(way), dtype=np.int64) for way in ways]
+    ways, refs = [way for way, r in zip(ways, refs) if len(r) != 0], [r for r in refs if len(r) != 0]
+    if len(ways) == 0:
+        return [], np.zeros((0, 2)), np.zeros(1, dtype=np.intp)
+    offsets = _offsets(list(map(len, refs)))
+    nodes = osm_helper.osm_data.nodes
+    try:
+        return ways, nodes.coordinates(np.concatenate(refs)), offsets
+    except KeyError:
+        complete = np.logical_and.reduceat(np.isin(np.concatenate(refs), nodes.ids), offsets[:-1])
+        return _ways_points([way for way, keep in zip(ways, complete.tolist()) if keep], osm_helper)
+
+
+def _closed(points: np.ndarray, offsets: np.ndarray):
+    return (np.diff(offsets) >= 4) & (points[offsets[:-1]] == points[offsets[1:] - 1]).all(axis=1)
+
+
+def prefetch_geometry(elements: List[Element], osm_helper: OsmHelper):
+    """Computes the bbox and area of all ways at once, so accepting them does not look them up one by one."""
+    ways = [element for element in elements if element.tag == 'way' and element not in element_to_bbox.cache]
+    ways, points, offsets = _ways_points(ways, osm_helper)
+    if len(ways) == 0:
+        return
+    boxes = polygons_bbox(points, offsets)
+    areas = np.where(_closed(points, offsets), polygons_area(points, offsets), 0)
+    for way, (min_lat, min_lon, max_lat, max_lon), area in zip(ways, boxes.tolist(), areas.tolist()):
+        bbox = element_to_bbox.cache[way] = Rectangle(min_lat, min_lon, max_lat, max_lon)
+        element_to_area_m.cache[way] = area * _area_scale(bbox)
+
+
+def elements_to_polygons(elements: List[Element], osm_helper: OsmHelper):
+    """element_to_polygons of many elements, looking up the coordinates of all ways at once."""
+    cache = element_to_polygons.cache
+    ways, points, offsets = _ways_points([element for element in elements
+                                          if element.tag == 'way' and element not in cache], osm_helper)
+    closed = _closed(points, offsets).tolist()
+    points = list(map(tuple, points.tolist()))
+    for way, start, end, closed in zip(ways, offsets[:-1].tolist(), offsets[1:].tolist(), closed):
+        cache[way] = [points[start:end - 1]] if closed else []
+    return [element_to_polygons(element, osm_helper) for element in elements]
+
+
+def elements_to_label_points(elements: List[Element], osm_helper: OsmHelper):
+    """element_to_label_point of many elements, the centroids of single rings are computed all at once and only
+    the remaining elements run polylabel."""
+    cache = element_to_label_point.cache
+    pending = [element for element in elements if element.tag != 'node' and element not in cache]
+    elements_to_polygons(pending, osm_helper)
+    single = [(element, rings[0]) for element, rings in
+              zip(pending, (_label_rings(element, osm_helper) for element in pending)) if len(rings) == 1]
+    for (element, ring), point in zip(single, _centroid_labels([ring for element, ring in single])):
+        if point is not None:
+            cache[element] = point
+    return [element_to_label_point(element, osm_helper) for element in elements]
+
+
+def _centroid_labels(rings: List[List[Tuple[float, float]]]):
+    # the centroid of a convex or small ring is inside it (or close enough), None where polylabel is needed
+    rings = [ring[:-1] if len(ring) != 0 and ring[0] == ring[-1] else ring for ring in rings]
+    out = [None] * len(rings)
+    indices = [i for i, ring in enumerate(rings) if len(ring) >= 3]
+    if len(indices) == 0:
+        return out
+    points = np.array([point for i in indices for point in rings[i]], dtype=np.float64)
+    offsets = _offsets([len(rings[i]) for i in indices])
+    boxes = polygons_bbox(points, offsets)
+    # the larger side in meters, longitudes are shorter away from the equator
+    size = np.maximum(boxes[:, 2] - boxes[:, 0], (boxes[:, 3] - boxes[:, 1]) *
+                      np.cos(np.radians((boxes[:, 0] + boxes[:, 2]) / 2))) * (_EARTH_CIRCUMFERENCE_M / 360)
+    use = polygons_convex(points, offsets) | (size * ZOOM_CAMERAS[-1].px_per_meter() < _LABEL_SMALL_PX)
+    # rings without area have no centroid, polylabel falls back to the center of their bounding box
+    centroids = polygons_centroid(points, offsets)
+    use &= np.isfinite(centroids).all(axis=1)
+    for i, inside, point in zip(indices, use.tolist(), centroids.tolist()):
+        if inside:
+            out[i] = tuple(point)
+    return out
+
+
+def _is_multipolygon(element: Element):
+    return element.tag == 'relation' and tag_dict(element).get('type') == 'multipolygon'
+
+
 @_memoize
 def element_to_polygons(element: Element, osm_helper: OsmHelper):
-    if element.tag == 'relation' and tag_dict(element).get('type') == 'multipolygon':
+    if _is_multipolygon(element):
         return [polygon[:-1] for polygon in osm_helper.multipolygon_to_wsps(element)]
     elif element.tag == 'way':
         way = osm_helper.way_coordinates(element)
@@ -48,26 +211,67 @@ def element_to_polygons(element: Element, osm_helper: OsmHelper):
     return []
 
 
+def _rings_area(rings: List[List[Tuple[float, float]]]):
+    # the same as the area of the wsps, without building them: rings nested an odd number of times are holes
+    boxes = np.array([np.concatenate([np.min(ring, axis=0), np.max(ring, axis=0)]) for ring in rings]).reshape(-1, 4)
+    starts = np.array([ring[0] for ring in rings]).reshape(-1, 2)
+    depth = np.zeros(len(rings), dtype=int)
+    for j, other in enumerate(rings):
+        candidates = (boxes[j, :2] <= boxes[:, :2]).all(axis=1) & (boxes[:, 2:] <= boxes[j, 2:]).all(axis=1)
+        candidates[j] = False
+        if candidates.any():
+            depth[candidates] += points_in_polygon(starts[candidates], other)
+    return sum(-polygon_area(ring) if d % 2 == 1 else polygon_area(ring) for ring, d in zip(rings, depth.tolist()))
+
+
 @_memoize
 def element_to_area_m(element: Element, osm_helper: OsmHelper):
-    area = sum(map(polygon_area, element_to_polygons(element, osm_helper)))
-    bbox = element_to_bbox(element, osm_helper)
-    scale = (40000000 / 360) ** 2 * math.cos(math.radians(bbox.max_lat + bbox.min_lat) / 2)
-    return area * scale
+    if _is_multipolygon(element):
+        area = _rings_area(osm_helper.multipolygon_to_polygons(element))
+    else:
+        area = sum(map(polygon_area, element_to_polygons(element, osm_helper)))
+    return area * _area_scale(element_to_bbox(element, osm_helper))
+
+
+def _area_scale(bbox: Rectangle):
+    # square degrees to square meters
+    return (_EARTH_CIRCUMFERENCE_M / 360) ** 2 * math.cos(math.radians(bbox.max_lat + bbox.min_lat) / 2)
+
+
+def element_has_polygons(element: Element, osm_helper: OsmHelper):
+    """A cheap test whether element_to_polygons can return anything: a closed way or a multipolygon with outer ways.
+    Only the refs and members are looked at, no coordinates."""
+    if element.tag == 'way':
+        refs = osm_helper.way_refs(element)
+        return len(refs) >= 4 and refs[0] == refs[-1]
+    if _is_multipolygon(element):
+        return any(member_type == 'way' and role != 'inner' and ref in osm_helper.ways
+                   for member_type, ref, role in osm_helper.relations.get(int(element.get('id')), ()))
+    return False
 
 
 @_memoize
 def element_to_lines(element: Element, osm_helper: OsmHelper):
-    if element.tag == 'relation' and tag_dict(element).get('type') == 'multipolygon':
+    if _is_multipolygon(element):
         return osm_helper.multipolygon_to_polygons(element)
     elif element.tag == 'way':
         return [osm_helper.way_coordinates(element)]
     return []
 
 
+@_memoize
+def element_to_simplified_polygons(element: Element, osm_helper: OsmHelper):
+    return [LevelsOfDetail(polygon, ring=True) for polygon in element_to_polygons(element, osm_helper)]
+
+
+@_memoize
+def element_to_simplified_lines(element: Element, osm_helper: OsmHelper):
+    return list(map(LevelsOfDetail, element_to_lines(element, osm_helper)))
+
+
 @_memoize
 def element_to_points(element: Element, osm_helper: OsmHelper):
-    if element.tag == 'relation' and tag_dict(element).get('type') == 'multipolygon':
+    if _is_multipolygon(element):
         return [point for polygon in osm_helper.multipolygon_to_polygons(element) for point in polygon]
     elif element.tag == 'way':
         way = osm_helper.way_coordinates(element)
@@ -75,19 +279,53 @@ def element_to_points(element: Element, osm_helper: OsmHelper):
             return way[:-1]
         return way
     elif element.tag == 'node':
-        return [(float(element.attrib['lat']), float(element.attrib['lon']))]
+        return [osm_helper.node_coordinates(element)]
     return []
 
 
+def _label_rings(element: Element, osm_helper: OsmHelper):
+    if _is_multipolygon(element):
+        return osm_helper.multipolygon_to_polygons(element)
+    return element_to_polygons(element, osm_helper)
+
+
+@_memoize
+def element_to_label_point(element: Element, osm_helper: OsmHelper):
+    # a point inside the element, far from its outline (a centroid falls outside of concave shapes)
+    if element.tag == 'node':
+        return osm_helper.node_coordinates(element)
+    rings = _label_rings(element, osm_helper)
+    if len(rings) == 0:
+        return None
+    if len(rings) == 1:
+        point = _centroid_labels(rings)[0]
+        if point is not None:
+            return point
+    rings = [np.asarray(ring, dtype=np.float64) for ring in rings]
+    # distances are measured in degrees of latitude
+    scale = math.cos(math.radians(rings[0][0, 0]))
+    x, y = polylabel([ring[:, ::-1] * (scale, 1) for ring in rings])
+    return y, x / scale
+
+
 @_memoize
 def element_to_bbox(element: Element, osm_helper: OsmHelper):
-    points = element_to_points(element, osm_helper)
+    # only needs the coordinates, multipolygons are not assembled
+    if element.tag == 'node':
+        lat, lon = osm_helper.node_coordinates(element)
+        return Rectangle(lat, lon, lat, lon)
+    elif element.tag == 'way':
+        points = [osm_helper.way_coordinates_array(element)]
+    elif _is_multipolygon(element):
+        points = osm_helper.multipolygon_way_coordinates(element)
+    else:
+        points = []
+    points = [way for way in points if len(way) != 0]
     if len(points) == 0:
         return Rectangle(0, 0, 0, 0)
-    from operator import itemgetter
-    bbox = Rectangle(min(points, key=itemgetter(0))[0], min(points, key=itemgetter(1))[1],
-                     max(points, key=itemgetter(0))[0], max(points, key=itemgetter(1))[1])
-    return bbox
+    points = np.concatenate(points)
+    (min_lat, min_lon), (max_lat, max_lon) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+    return Rectangle(min_lat, min_lon, max_lat, max_lon)
 
 
 class BaseStyle:
@@ -97,7 +335,10 @@ class BaseStyle:
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
         return element
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
+    def convert_many(self, elements: List[Element], tags: List[dict], osm_helper: OsmHelper):
+        return [self.convert(element, element_tags, osm_helper) for element, element_tags in zip(elements, tags)]
+
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
         return True
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
@@ -112,20 +353,25 @@ class StyleArea(BaseStyle):
 
     def wants_element(self, element: Element, tags: dict, osm_helper: OsmHelper):
         if element.tag == 'relation':
-            return tags.get('type') == 'multipolygon'
-        return element.tag == 'way' and (not self.require_area or tags.get('area') == 'yes')
+            return element_has_polygons(element, osm_helper)
+        return element.tag == 'way' and (not self.require_area or tags.get('area') == 'yes') and \
+            element_has_polygons(element, osm_helper)
 
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
-        return element_to_polygons(element, osm_helper), element_to_area_m(element, osm_helper), element.attrib['id']
+        return element_to_simplified_polygons(element, osm_helper), element_to_area_m(element, osm_helper), \
+            element.get('id')
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
-        polygons, area, id = feature
+    def convert_many(self, elements: List[Element], tags: List[dict], osm_helper: OsmHelper):
+        elements_to_polygons(elements, osm_helper)
+        return super().convert_many(elements, tags, osm_helper)
+
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
         return area * (camera.px_per_meter() ** 2) >= self.min_area
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
-        for polygons, area, id in features:
-            for polygon in transform_shapes(polygons, camera):
-                image_draw.polygon(polygon, fill=self.fill)
+        polygons = simplify_shapes([shape for shapes, area, id in features for shape in shapes], camera)
+        for polygon in clip_polygons(polygons, camera):
+            image_draw.polygon(polygon, fill=self.fill)
 
 
 @dataclass(frozen=True)
@@ -137,23 +383,23 @@ class StyleLine(BaseStyle):
     skip_area: bool = False
 
     def wants_element(self, element: Element, tags: dict, osm_helper: OsmHelper):
-        if self.skip_area:
-            return element.tag == 'way' and tags.get('area') != 'yes'
-        else:
-            return element.tag == 'way' or (element.tag == 'relation' and tags.get('type') == 'multipolygon')
+        if element.tag == 'way':
+            return (not self.skip_area or tags.get('area') != 'yes') and len(osm_helper.way_refs(element)) >= 2
+        # element_has_polygons only accepts multipolygon relations
+        return not self.skip_area and element.tag == 'relation' and element_has_polygons(element, osm_helper)
 
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
-        return element_to_lines(element, osm_helper)
+        return element_to_simplified_lines(element, osm_helper)
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
         return camera.px_per_meter() >= self.min_ppm
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
         width = int(self.width * (camera.px_per_meter() ** self.exponent))
         if self.draws_at_zoom(None, camera, osm_helper):
-            for lines in features:
-                for line in transform_shapes(lines, camera):
-                    image_draw.line(line, fill=self.fill, width=width, joint='curve')
+            lines = simplify_shapes([shape for shapes in features for shape in shapes], camera)
+            for line in clip_lines(lines, camera, width):
+                image_draw.line(line, fill=self.fill, width=width, joint='curve')
 
 
 @dataclass(frozen=True)
@@ -167,15 +413,17 @@ class StylePoint(BaseStyle):
         return not self.require_node and element.tag == 'node'
 
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
-        return element_to_points(element)
+        return element_to_points(element, osm_helper)
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
         return camera.px_per_meter() >= self.min_ppm
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
         if self.draws_at_zoom(None, camera, osm_helper):
-            for points in features:
-                for x, y in transform_shapes([points], camera)[0]:
+            for points in transform_shapes(features, camera):
+                for x, y in points.tolist():
+                    if not in_viewport((x, y), camera, self.width):
+                        continue
                     x1, x2 = x - self.width / 2, x + self.width / 2
                     y1, y2 = y - self.width / 2, y + self.width / 2
                     image_draw.ellipse([(x1, y1), (x2, y2)], fill=self.fill, width=0)
@@ -200,10 +448,14 @@ class StyleOutlined(BaseStyle):
     def convert(self, element: Element, tags: dict, osm_helper: OsmHelper):
         return self.area.convert(element, tags, osm_helper), self.line.convert(element, tags, osm_helper)
 
-    def draws_at_zoom(self, feature, camera: Camera, osm_helper: OsmHelper):
-        feature_area, feature_line = feature
-        return self.line.draws_at_zoom(feature_line, camera, osm_helper) or \
-               self.area.draws_at_zoom(feature_area, camera, osm_helper)
+    def convert_many(self, elements: List[Element], tags: List[dict], osm_helper: OsmHelper):
+        return list(zip(self.area.convert_many(elements, tags, osm_helper),
+                        self.line.convert_many(elements, tags, osm_helper)))
+
+    def draws_at_zoom(self, area: float, camera: Camera, osm_helper: OsmHelper):
+        # | rather than or, the area may be an array of areas
+        return self.line.draws_at_zoom(area, camera, osm_helper) | \
+            self.area.draws_at_zoom(area, camera, osm_helper)
 
     def draw(self, features: List, osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
         features_area, features_line = zip(*features)
@@ -227,42 +479,148 @@ def explode_features(features: List[Feature]):
     return exploded
 
 
+_LAZY = ...  # feature not converted yet
+
+
 class BaseArtist:
+    # convert features on first draw, load only computes what the location and zoom filters need
+    lazy = True
+    # classified first while loading, to show a partial frame early
+    preview = False
+
     def __init__(self, features=()):
         self.styles = explode_features(features)
         self.map = WeakKeyDictionary()
         self.data = WeakKeyDictionary()
-        self._camera = Camera()
 
-    def wants_element(self, element: Element, osm_helper: OsmHelper):
-        tags = tag_dict(element)
+    def match(self, tags: dict):
         for key, features in self.styles.items():
             try:
-                feature: MappedFeature = features[tags[key]]
-                if feature.style.wants_element(element, tags, osm_helper):
-                    self.map[element] = feature
-                    self.data[element] = feature.style.convert(element, tags, osm_helper), element_to_bbox(element, osm_helper)
-                    return self.data[element][0] is not None
-                return False
+                return features[tags[key]]
             except KeyError:
                 pass
-        return False
+        return None
+
+    def wants_element(self, element: Element, osm_helper: OsmHelper):
+        tags = tag_dict(element)
+        return self.accept_element(element, self.match(tags), tags, osm_helper)
+
+    def accept_element(self, element: Element, feature: MappedFeature, tags: dict, osm_helper: OsmHelper):
+        # wants_element checks the structure (refs, closed ways, outer members), so a lazy feature is expected to
+        # convert to something; the few that still convert to None are skipped when drawn
+        if feature is None or not feature.style.wants_element(element, tags, osm_helper):
+            return False
+        try:
+            if self.lazy:
+                # the area of a multipolygon needs its rings and their nesting, it is computed when first drawn
+                area = _LAZY if _is_multipolygon(element) else element_to_area_m(element, osm_helper)
+                data = _LAZY, element_to_bbox(element, osm_helper), area
+            else:
+                data = feature.style.convert(element, tags, osm_helper), element_to_bbox(element, osm_helper), \
+                    element_to_area_m(element, osm_helper)
+        except KeyError:  # missing nodes or ways
+            return False
+        self.map[element] = feature
+        self.data[element] = data
+        return data[0] is not None
+
+    def feature(self, element: Element, osm_helper: OsmHelper):
+        converted, bbox, area = self.data[element]
+        if converted is _LAZY:
+            try:
+                converted = self.map[element].style.convert(element, tag_dict(element), osm_helper)
+            except KeyError:
+                converted = None
+            self.data[element] = converted, bbox, area
+        return converted
+
+    def export_element(self, element: Element):
+        """The state of an element as a tuple of numbers, the converted feature is not kept."""
+        converted, bbox, area = self.data[element]
+        return (float(converted is None), bbox.min_lat, bbox.min_lon, bbox.max_lat, bbox.max_lon,
+                math.nan if area is _LAZY else float(area))
+
+    def import_element(self, element: Element, state, osm_helper: OsmHelper):
+        empty, min_lat, min_lon, max_lat, max_lon, area = state
+        feature = self.match(tag_dict(element))
+        converted = None if empty else _LAZY
+        if converted is _LAZY and not self.lazy:
+            try:
+                converted = feature.style.convert(element, tag_dict(element), osm_helper)
+            except KeyError:
+                converted = None
+        self.map[element] = feature
+        self.data[element] = converted, Rectangle(min_lat, min_lon, max_lat, max_lon), \
+            _LAZY if math.isnan(area) else area
 
     def draws_at_zoom(self, element: Element, zoom: int, osm_helper: OsmHelper):
-        feature, bbox = self.data[element]
-        self._camera.zoom_level = zoom
-        self._camera.center_at((bbox.min_lat + bbox.max_lat) / 2, (bbox.min_lon + bbox.max_lon) / 2)
-        return self.map[element].style.draws_at_zoom(feature, self._camera, osm_helper)
+        self.resolve_areas([element], osm_helper)
+        return bool(self.zoom_masks([element], osm_helper)[0] >> zoom & 1)
+
+    def resolve_areas(self, elements: List[Element], osm_helper: OsmHelper):
+        """Computes the areas left out while loading."""
+        for element in elements:
+            converted, bbox, area = self.data[element]
+            if area is _LAZY:
+                self.data[element] = converted, bbox, element_to_area_m(element, osm_helper)
+
+    def _area(self, element: Element):
+        converted, bbox, area = self.data[element]
+        if area is _LAZY:
+            # an upper bound, the mask may include zoom levels the element is not drawn at, draw checks them again
+            return (bbox.max_lat - bbox.min_lat) * (bbox.max_lon - bbox.min_lon) * _area_scale(bbox)
+        return area
+
+    def zoom_masks(self, elements: List[Element], osm_helper: OsmHelper):
+        """Bit z of the mask of an element is set when it is drawn at zoom level z."""
+        out = np.zeros(len(elements), dtype=np.uint32)
+        by_feature = defaultdict(list)
+        for i, element in enumerate(elements):
+            if self.data[element][0] is not None:
+                by_feature[self.map[element]].append(i)
+        # the styles only look at the area and the zoom level, they are asked for all elements at once
+        for feature, indices in by_feature.items():
+            areas = np.array([self._area(elements[i]) for i in indices], dtype=np.float64)
+            for zoom, camera in enumerate(ZOOM_CAMERAS):
+                draws = np.broadcast_to(feature.style.draws_at_zoom(areas, camera, osm_helper), areas.shape)
+                out[indices] |= draws.astype(np.uint32) << zoom
+        return out
+
+    def convert_many(self, elements: List[Element], osm_helper: OsmHelper):
+        # convert the lazy features of each style together, so the styles can vectorize it
+        pending = defaultdict(list)
+        for element in elements:
+            if self.data[element][0] is _LAZY:
+                pending[self.map[element]].append(element)
+        for feature, elements in pending.items():
+            try:
+                converted = feature.style.convert_many(elements, list(map(tag_dict, elements)), osm_helper)
+            except KeyError:  # missing nodes or ways, convert one by one
+                continue
+            for element, element_converted in zip(elements, converted):
+                _, bbox, area = self.data[element]
+                self.data[element] = element_converted, bbox, area
 
     def draw(self, elements: List[Element], osm_helper: OsmHelper, camera: Camera, image_draw: ImageDraw):
+        self.convert_many(elements, osm_helper)
+        lazy = [element for element in elements if self.data[element][2] is _LAZY]
+        if len(lazy) != 0:
+            # the location filter only had an upper bound of their area
+            self.resolve_areas(lazy, osm_helper)
+            zoom = min(max(int(camera.zoom_level), 0), MAX_ZOOM_LEVEL)
+            hidden = {element for element, mask in zip(lazy, self.zoom_masks(lazy, osm_helper).tolist())
+                      if not mask >> zoom & 1}
+            elements = [element for element in elements if element not in hidden]
         layers = defaultdict(list)
         for element in elements:
-            layers[self.map[element]].append(self.data[element][0])
+            converted = self.feature(element, osm_helper)
+            if converted is not None:
+                layers[self.map[element]].append(converted)
         for style in sorted(layers):
             style.style.draw(layers[style], osm_helper, camera, image_draw)
 
     def approx_location(self, element: Element, osm_helper: OsmHelper):
-        feature, bbox = self.data[element]
+        converted, bbox, area = self.data[element]
         return [bbox]
 
     def __str__(self):
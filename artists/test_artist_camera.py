@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class BoxCamera:
     """A mock implementation of camera. For testing purposes only."""
     def __init__(self, bounds, dimensions):
@@ -19,3 +22,18 @@ class BoxCamera:
         y = (self.max_lat - lat) / self.lat_height * self.px_height
         x = (lon - self.min_lon) / self.lon_width * self.px_width
         return x, y
+
+    def px_to_gps_array(self, px_points):
+        x, y = np.asarray(px_points, dtype=np.float64).reshape(-1, 2).T
+        return np.stack([self.max_lat - y / self.px_height * self.lat_height,
+                         self.min_lon + x / self.px_width * self.lon_width], axis=1)
+
+    def gps_to_px_array(self, gps_points):
+        lat, lon = np.asarray(gps_points, dtype=np.float64).reshape(-1, 2).T
+        return np.stack([(lon - self.min_lon) / self.lon_width * self.px_width,
+                         (self.max_lat - lat) / self.lat_height * self.px_height], axis=1)
+
+    def mercator_to_px_array(self, points):
+        x, y = np.asarray(points, dtype=np.float64).reshape(-1, 2).T
+        lat = np.degrees(np.arctan(np.exp(-y * np.pi * 2))) * 2 - 90
+        return self.gps_to_px_array(np.stack([lat, x * 360], axis=1))
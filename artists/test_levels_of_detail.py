@@ -0,0 +1,61 @@
+import random
+
+import numpy as np
+
+from base_artist import LevelsOfDetail
+from camera import MAX_ZOOM_LEVEL
+
+
+def random_ring(rng: random.Random, count: int, size: float):
+    lat, lon = rng.uniform(47, 49), rng.uniform(16, 18)
+    angles = sorted(rng.uniform(0, 2 * np.pi) for i in range(count))
+    return [(lat + size * rng.uniform(0.5, 1) * np.sin(a), lon + size * rng.uniform(0.5, 1) * np.cos(a))
+            for a in angles]
+
+
+def contains(a, b):
+    # every point of b is in a, in the same order
+    a, b = list(map(tuple, a.tolist())), list(map(tuple, b.tolist()))
+    i = 0
+    for point in a:
+        if i < len(b) and point == b[i]:
+            i += 1
+    return i == len(b)
+
+
+print('testing base_artist.LevelsOfDetail')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(19)
+
+# from buildings to forests, the small ones disappear into very few points when zoomed out
+shapes = [(random_ring(rng, count, size), ring) for count in (3, 4, 8, 30, 200) for size in (1e-5, 1e-4, 1e-3, 1e-2)
+          for ring in (False, True)]
+for shape, ring in shapes:
+    lod = LevelsOfDetail(shape, ring=ring)
+    fail = None
+    previous = None
+    for zoom in range(MAX_ZOOM_LEVEL + 1):
+        points = lod.at_zoom(zoom)
+        mercator = lod.points
+        if len(points) < (3 if ring else 2):
+            fail = 'only {} points at zoom {}'.format(len(points), zoom)
+        elif not (np.array_equal(points[0], mercator[0]) and np.array_equal(points[-1], mercator[-1])):
+            fail = 'end points missing at zoom {}'.format(zoom)
+        elif previous is not None and not contains(points, previous):
+            fail = 'zoom {} does not keep all points of zoom {}'.format(zoom, zoom - 1)
+        if fail is not None:
+            break
+        previous = points
+    if fail is None and len(lod.at_zoom(MAX_ZOOM_LEVEL)) > len(shape):
+        fail = 'more points than the shape'
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for {} with {} points: {}'.format('ring' if ring else 'line', len(shape), fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
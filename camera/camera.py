@@ -9,18 +9,13 @@ _EARTH_CIRCUMFERENCE_M = 40000000
 _TYPICAL_WINDOW_WIDTH = 800
 
 
-# https://wiki.python.org/moin/PythonDecoratorLibrary#Alternate_memoize_as_dict_subclass
-class _memoize(dict):
-    def __init__(self, func):
-        super().__init__()
-        self.func = func
-
-    def __call__(self, *args):
-        return self[args]
-
-    def __missing__(self, key):
-        result = self[key] = self.func(*key)
-        return result
+def gps_to_mercator(gps_points: np.ndarray):
+    """Web Mercator coordinates of an array of (lat, lon) rows, one unit is the circumference of the Earth."""
+    gps_points = np.asarray(gps_points, dtype=np.float64).reshape(-1, 2)
+    points = np.empty_like(gps_points)
+    points[:, 0] = gps_points[:, 1] / 360
+    points[:, 1] = -np.log(np.tan(np.radians(gps_points[:, 0] / 2 + 45))) / math.tau
+    return points
 
 
 def get_typical_view_size(zoom_level: int):
@@ -67,26 +62,36 @@ class Camera:
     def px_per_meter(self): return self._ppm
 
     @staticmethod
-    @_memoize
     def gps_to_point(lat: float, lon: float):
         return lon / 360, -math.log(math.tan(math.radians(lat / 2 + 45))) / math.tau
 
     @staticmethod
-    @_memoize
     def point_to_gps(x: float, y: float):
         return math.degrees(math.atan(math.exp(-y * math.tau))) * 2 - 90, x * 360
 
     def gps_to_px(self, gps_point: (float, float)):
-        x, y = self.gps_to_point(*gps_point)
-        dist = np.array((x, y)) - self._center_point
-        dist_px = dist * _EARTH_CIRCUMFERENCE_M * self._scale
-        return tuple((self.dimensions / 2) + dist_px)
-    
+        return tuple(self.gps_to_px_array(gps_point)[0].tolist())
+
     def px_to_gps(self, px_point: (int, int)):
-        dist_px = np.array(px_point) - (self.dimensions / 2)
-        dist = dist_px / _EARTH_CIRCUMFERENCE_M / self._scale
-        x, y = dist + self._center_point
-        return self.point_to_gps(x, y)
+        return tuple(self.px_to_gps_array(px_point)[0].tolist())
+
+    def gps_to_px_array(self, gps_points: np.ndarray):
+        """gps_to_px of an array of (lat, lon) rows, returns an array of (x, y) rows."""
+        return self.mercator_to_px_array(gps_to_mercator(gps_points))
+
+    def mercator_to_px_array(self, points: np.ndarray):
+        """Pixels of an array of gps_to_mercator points, only a scale and an offset."""
+        scale = _EARTH_CIRCUMFERENCE_M * self._scale
+        return points * scale + (self.dimensions / 2 - np.multiply(self._center_point, scale))
+
+    def px_to_gps_array(self, px_points: np.ndarray):
+        """px_to_gps of an array of (x, y) rows, returns an array of (lat, lon) rows."""
+        px_points = np.asarray(px_points, dtype=np.float64).reshape(-1, 2)
+        points = (px_points - self.dimensions / 2) / (_EARTH_CIRCUMFERENCE_M * self._scale) + self._center_point
+        gps_points = np.empty_like(points)
+        gps_points[:, 0] = np.degrees(np.arctan(np.exp(-points[:, 1] * math.tau))) * 2 - 90
+        gps_points[:, 1] = points[:, 0] * 360
+        return gps_points
 
     def get_rect(self):
         a, b = self.px_to_gps((0, 0)), self.px_to_gps(self.dimensions)
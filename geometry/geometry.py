@@ -1,4 +1,4 @@
-from collections import namedtuple
+from bisect import bisect_right
 from typing import List, Tuple
 
 import numpy as np
@@ -39,23 +39,231 @@ def polygon_centroid(polygon: List[_Point]):
         / 3 / _polygon_raw_area(polygon) + offset
 
 
+def _ragged_edges(points: np.ndarray, offsets: np.ndarray):
+    # polygon i is points[offsets[i]:offsets[i + 1]], shifted to near (0, 0) for precision like polygon_area,
+    # closing edges are added where a polygon does not repeat its first point
+    points, offsets = np.asarray(points, dtype=np.float64).reshape(-1, 2), np.asarray(offsets, dtype=np.intp)
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    if (lengths <= 0).any():
+        raise ValueError('Empty polygon')
+    origin = np.repeat(points[starts], lengths, axis=0)
+    following = np.arange(1, len(points) + 1)
+    following[offsets[1:] - 1] = starts
+    a = points - origin
+    b = points[following] - origin
+    return a, b, starts, origin
+
+
+def polygons_area(points: np.ndarray, offsets: np.ndarray):
+    """polygon_area of many polygons given as one array of points and len(polygons) + 1 offsets."""
+    a, b, starts, origin = _ragged_edges(points, offsets)
+    return 0.5 * np.abs(np.add.reduceat(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0], starts))
+
+
+def polygons_centroid(points: np.ndarray, offsets: np.ndarray):
+    """polygon_centroid of many polygons given as one array of points and len(polygons) + 1 offsets."""
+    a, b, starts, origin = _ragged_edges(points, offsets)
+    cross = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.add.reduceat((a + b) * cross[:, None], starts) / 3 / np.add.reduceat(cross, starts)[:, None] + \
+            origin[starts]
+
+
+def polygons_convex(points: np.ndarray, offsets: np.ndarray):
+    """Whether each of many polygons, given as in polygons_area, turns the same way at every vertex (collinear
+    vertices are allowed). The first point must not be repeated at the end, the closing edge is added."""
+    a, b, starts, origin = _ragged_edges(points, offsets)
+    edges = b - a
+    # the edge before each edge, wrapping around within its polygon
+    previous = np.arange(-1, len(edges) - 1)
+    previous[starts] = np.asarray(offsets, dtype=np.intp)[1:] - 1
+    cross = np.sign(edges[previous, 0] * edges[:, 1] - edges[previous, 1] * edges[:, 0])
+    return (np.maximum.reduceat(cross, starts) - np.minimum.reduceat(cross, starts)) < 2
+
+
+def polygons_bbox(points: np.ndarray, offsets: np.ndarray):
+    """Bounding boxes (min x, min y, max x, max y) of many polygons given as one array of points and offsets."""
+    points, starts = np.asarray(points, dtype=np.float64).reshape(-1, 2), np.asarray(offsets, dtype=np.intp)[:-1]
+    if (np.diff(offsets) <= 0).any():
+        raise ValueError('Empty polygon')
+    return np.concatenate([np.minimum.reduceat(points, starts), np.maximum.reduceat(points, starts)], axis=1)
+
+
+def simplification_tolerances(points: np.ndarray, min_tolerance: float = 0, ring: bool = False):
+    """Douglas-Peucker for all tolerances at once: simplifying with tolerance t keeps points[out >= t].
+
+    The end points are always kept, deviations below min_tolerance are not refined (those vertices get 0). With ring
+    the points are a closed ring without the first point repeated, one more vertex is always kept so at least
+    a triangle remains.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    out = np.zeros(len(points))
+    if len(points) == 0:
+        return out
+    out[[0, -1]] = np.inf
+    stack = [(0, len(points) - 1, np.inf)]
+    while len(stack) != 0:
+        first, last, limit = stack.pop()
+        if last - first < 2:
+            continue
+        a, ab, ap = points[first], points[last] - points[first], points[first + 1:last] - points[first]
+        length = np.dot(ab, ab)
+        t = np.clip(ap @ ab / length, 0, 1) if length != 0 else 0
+        distance = np.hypot(*(ap - np.multiply.outer(t, ab)).T)
+        i = distance.argmax()
+        if distance[i] < min_tolerance:
+            continue
+        # a vertex is never kept at a tolerance where the vertex that split its segment is not
+        i, tolerance = first + 1 + i, min(distance[i], limit)
+        out[i] = tolerance
+        stack += [(first, i, tolerance), (i, last, tolerance)]
+    if ring and len(points) >= 3:
+        # the first split, its vertices' tolerances are all below it
+        out[1 + out[1:-1].argmax()] = np.inf
+    return out
+
+
+def _inside_rect(points: np.ndarray, rect):
+    min_x, min_y, max_x, max_y = rect
+    return (min_x <= points[:, 0]) & (points[:, 0] <= max_x) & (min_y <= points[:, 1]) & (points[:, 1] <= max_y)
+
+
+def clip_polygon(polygon, rect):
+    """Sutherland-Hodgman clipping of a polygon to a rectangle (min x, min y, max x, max y).
+
+    The result is an array of points, empty when the polygon lies outside. A concave polygon may come back with
+    degenerate edges along the rectangle, which draw nothing when the rectangle is outside the image.
+    """
+    points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    if len(points) != 0 and (points[0] == points[-1]).all():
+        points = points[:-1]
+    if _inside_rect(points, rect).all():
+        return points
+    if len(points) < 3:
+        return np.zeros((0, 2))
+    for axis, bound, sign in ((0, rect[0], 1), (1, rect[1], 1), (0, rect[2], -1), (1, rect[3], -1)):
+        inside = sign * (points[:, axis] - bound) >= 0
+        if inside.all():
+            continue
+        # edge i leads from points[i - 1] to points[i], it emits the crossing of the bound and then points[i]
+        previous = np.roll(points, 1, axis=0)
+        crossing = inside != np.roll(inside, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (bound - previous[:, axis]) / (points[:, axis] - previous[:, axis])
+            hits = previous + t[:, None] * (points - previous)
+        hits[:, axis] = bound
+        points = np.stack([hits, points], axis=1)[np.stack([crossing, inside], axis=1)]
+        if len(points) < 3:
+            return np.zeros((0, 2))
+    return points
+
+
+def clip_polyline(line, rect):
+    """Liang-Barsky clipping of a polyline to a rectangle (min x, min y, max x, max y).
+
+    Returns a list of arrays of points, a line leaving and entering the rectangle again is split.
+    """
+    points = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+    inside = _inside_rect(points, rect)
+    if inside.all():
+        return [points] if len(points) != 0 else []
+    if len(points) < 2:
+        return []
+    a, d = points[:-1], np.diff(points, axis=0)
+    # the part a + t * d of a segment with t_enter <= t <= t_exit is inside
+    t_enter, t_exit = np.zeros(len(a)), np.ones(len(a))
+    for p, q in ((-d[:, 0], a[:, 0] - rect[0]), (d[:, 0], rect[2] - a[:, 0]),
+                 (-d[:, 1], a[:, 1] - rect[1]), (d[:, 1], rect[3] - a[:, 1])):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = q / p
+        t_enter = np.where(p < 0, np.maximum(t_enter, t), t_enter)
+        t_exit = np.where(p > 0, np.minimum(t_exit, t), t_exit)
+        # parallel to the bound and outside of it
+        t_exit[(p == 0) & (q < 0)] = -1
+    visible = t_enter <= t_exit
+    if not visible.any():
+        return []
+    # a segment continues the previous run only when the line does not leave the rectangle in between
+    starts = visible & ~np.concatenate([[False], visible[:-1] & (t_exit[:-1] == 1) & (t_enter[1:] == 0)])
+    first, last = a + t_enter[:, None] * d, a + t_exit[:, None] * d
+    out = np.stack([first, last], axis=1)[np.stack([starts, visible], axis=1)]
+    # every run starts with two points, the run boundaries are where the starts land in the output
+    run_starts = np.flatnonzero(starts[visible]) + np.arange(np.count_nonzero(starts))
+    return np.split(out, run_starts[1:])
+
+
 def _ray_trace(point: np.ndarray, polygon: np.ndarray):
+    """Returns the x coordinates and the edge indices of the hits of a ray cast from point towards +x."""
     poly = polygon - point
-    hits = []
-    for i, (a, b) in enumerate(zip(poly[:-1], poly[1:])):
-        # ensure Ay <= By
-        if a[1] > b[1]:
-            b, a = a, b
-        # 0 <= Ax - Ay * (Bx - Ax) / (By - Ay)  <==>  0 <= Ax * (By - Ay) - Ay * (Bx - Ax)
-        x_over_dy = np.cross(a, b - a)
-        if a[1] <= 0 < b[1] and 0 <= x_over_dy:
-            hit = np.array([x_over_dy / (b - a)[1], 0]) + point
-            hits.append(namedtuple('Hit', ['point', 'a', 'b'])(hit, i, i + 1))
-    return hits
+    # ensure Ay <= By
+    up = poly[:-1, 1] <= poly[1:, 1]
+    a = np.where(up[:, None], poly[:-1], poly[1:])
+    b = np.where(up[:, None], poly[1:], poly[:-1])
+    # 0 <= Ax - Ay * (Bx - Ax) / (By - Ay)  <==>  0 <= Ax * (By - Ay) - Ay * (Bx - Ax)
+    x_over_dy = np.cross(a, b - a)
+    edges = np.flatnonzero((a[:, 1] <= 0) & (0 < b[:, 1]) & (0 <= x_over_dy))
+    return x_over_dy[edges] / (b - a)[edges, 1] + point[0], edges
 
 
 def point_in_polygon(point: _Point, polygon: List[_Point]):
-    return len(_ray_trace(np.array(point), _norm_polygon(polygon))) % 2 == 1
+    return len(_ray_trace(np.array(point), _norm_polygon(polygon))[1]) % 2 == 1
+
+
+def points_in_polygon(points, polygon: List[_Point], block_size: int = 1 << 20):
+    """Vectorized point_in_polygon for many points, returns an array of bools."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = _norm_polygon(polygon) if not isinstance(polygon, np.ndarray) else polygon
+    if len(polygon) == 0:
+        raise ValueError('Empty polygon')
+    if (polygon[0] != polygon[-1]).any():
+        polygon = np.concatenate([polygon, polygon[:1]])
+    up = polygon[:-1, 1] <= polygon[1:, 1]
+    a = np.where(up[:, None], polygon[:-1], polygon[1:])
+    b = np.where(up[:, None], polygon[1:], polygon[:-1])
+    # skip edges which no ray crosses
+    edges = a[:, 1] < b[:, 1]
+    a, b = a[edges], b[edges]
+    out = np.zeros(len(points), dtype=bool)
+    step = max(1, block_size // max(1, len(a)))
+    for i in range(0, len(points), step):
+        x, y = points[i:i + step, 0, None], points[i:i + step, 1, None]
+        ax, ay, bx, by = a[:, 0] - x, a[:, 1] - y, b[:, 0] - x, b[:, 1] - y
+        hits = (ay <= 0) & (0 < by) & (0 <= ax * (by - ay) - ay * (bx - ax))
+        out[i:i + step] = np.count_nonzero(hits, axis=1) % 2 == 1
+    return out
+
+
+class _IntervalTree:
+    """Static centered interval tree over half-open intervals [lo, hi), answering stabbing queries."""
+    _LEAF_SIZE = 32
+
+    def __init__(self, lo: np.ndarray, hi: np.ndarray):
+        ids = np.flatnonzero(lo < hi)
+        self.lo, self.hi = lo, hi
+        self.root = self._build(ids)
+
+    def _build(self, ids: np.ndarray):
+        if len(ids) <= self._LEAF_SIZE:
+            return ids
+        lo, hi = self.lo[ids], self.hi[ids]
+        center = np.median((lo + hi) / 2)
+        here = (lo <= center) & (center < hi)
+        by_lo, by_hi = ids[here][np.argsort(lo[here])], ids[here][np.argsort(hi[here])]
+        return (center, by_lo, self.lo[by_lo], by_hi, self.hi[by_hi],
+                self._build(ids[hi <= center]), self._build(ids[center < lo]))
+
+    def query(self, y: float):
+        out, node = [], self.root
+        while isinstance(node, tuple):
+            center, by_lo, lo, by_hi, hi, left, right = node
+            if y < center:
+                out.append(by_lo[:np.searchsorted(lo, y, side='right')])
+                node = left
+            else:
+                out.append(by_hi[np.searchsorted(hi, y, side='right'):])
+                node = right
+        out.append(node[(self.lo[node] <= y) & (y < self.hi[node])])
+        return np.concatenate(out)
 
 
 def polygons_to_wsps(multipolygon: List[List[_Point]]):
@@ -68,21 +276,74 @@ def polygons_to_wsps(multipolygon: List[List[_Point]]):
         # ensure right-most point is first:
         polygon = np.roll(polygon[:-1], -polygon[:-1, 0].argmax(), axis=0)
         polygons.append(np.concatenate([polygon, [polygon[0]]]))
-    out = []
-    for polygon in sorted(polygons, key=lambda p: p[0, 0], reverse=True):
-        best_hit, best_hit_poly = None, None
-        for poly_out_index, poly_out in enumerate(out):
-            for hit in _ray_trace(polygon[0], poly_out):
-                if best_hit is None or hit.point[0] < best_hit.point[0]:
-                    best_hit, best_hit_poly = hit, poly_out_index
-        if best_hit is not None and out[best_hit_poly][best_hit.a][1] < out[best_hit_poly][best_hit.b][1]:
-            out[best_hit_poly] = np.concatenate([
-                out[best_hit_poly][:best_hit.a + 1, ],
-                [best_hit.point],
-                polygon[::-1, ],
-                [best_hit.point],
-                out[best_hit_poly][best_hit.b:, ]
-            ], axis=0)
+    polygons.sort(key=lambda p: p[0, 0], reverse=True)
+    if len(polygons) == 0:
+        return []
+
+    # edges of all polygons in processing order, the edges in the output at any time are those of the polygons
+    # processed so far (bridging only splits them), so one static index on y serves all queries
+    starts = np.cumsum([0] + [len(p) - 1 for p in polygons]).tolist()
+    a = np.concatenate([p[:-1] for p in polygons])
+    b = np.concatenate([p[1:] for p in polygons])
+    edges_up = a[:, 1] < b[:, 1]
+    lower, upper = np.where(edges_up[:, None], a, b), np.where(edges_up[:, None], b, a)
+    tree = _IntervalTree(lower[:, 1], upper[:, 1])
+
+    # the output rings are linked lists of vertices, so a hole is spliced in without copying the ring
+    points = [tuple(point) for point in a]
+    following = [i + 1 for i in range(len(a))]
+    tails, heads = list(range(len(a))), list(following)
+    for start, end in zip(starts[:-1], starts[1:]):
+        following[end - 1] = heads[end - 1] = start
+    reversed_edges = np.zeros(len(a), dtype=bool)
+    splits = {}
+    rings = []
+
+    for k, polygon in enumerate(polygons):
+        start, end = starts[k], starts[k + 1]
+        candidates = tree.query(polygon[0, 1])
+        candidates = candidates[candidates < start]
+        edge = None
+        if len(candidates) != 0:
+            # 0 <= Ax - Ay * (Bx - Ax) / (By - Ay)  <==>  0 <= Ax * (By - Ay) - Ay * (Bx - Ax)
+            la, lb = lower[candidates] - polygon[0], upper[candidates] - polygon[0]
+            x_over_dy = np.cross(la, lb - la)
+            hit = 0 <= x_over_dy
+            if hit.any():
+                candidates, hit_x = candidates[hit], (x_over_dy / (lb[:, 1] - la[:, 1]))[hit] + polygon[0, 0]
+                best = hit_x == hit_x.min()
+                edge, x = candidates[best].min(), hit_x[best][0]
+        if edge is not None and edges_up[edge] != reversed_edges[edge]:
+            # splice: ... -> hit -> hole reversed -> hit -> ...
+            y = polygon[0, 1]
+            keys, entries = splits.setdefault(edge, ([], []))
+            i = bisect_right(keys, y)
+            before = tails[edge] if i == 0 else entries[i - 1][1]
+            after = heads[edge] if i == len(entries) else entries[i][0]
+            hit_in, last, hit_out = range(len(points), len(points) + 3)
+            points += [(x, y), points[start], (x, y)]
+            following += [start, hit_out, after]
+            following[before] = hit_in
+            for j in range(start + 1, end):
+                following[j] = j - 1
+            following[start] = end - 1 if end - start > 1 else last
+            if end - start > 1:
+                following[start + 1] = last
+            keys.insert(i, y)
+            entries.insert(i, (hit_in, hit_out))
+            reversed_edges[start:end] = True
+            tails[start:end - 1], heads[start:end - 1] = range(start + 1, end), range(start, end - 1)
+            tails[end - 1], heads[end - 1] = start, end - 1
+            heads[start] = last
         else:
-            out.append(polygon)
-    return [[(x, y) for x, y in polygon] for polygon in out]
+            rings.append(start)
+
+    out = []
+    for start in rings:
+        ring, i = [points[start]], following[start]
+        while i != start:
+            ring.append(points[i])
+            i = following[i]
+        ring.append(points[start])
+        out.append(ring)
+    return out
@@ -0,0 +1,79 @@
+import numpy as np
+
+import geometry
+
+print('testing geometry.clip_polygon and geometry.clip_polyline')
+test_count = 0
+correct_tests = 0
+failure = None
+
+rect = (0, 0, 10, 10)
+
+# polygon, expected vertices (in any rotation)
+polygon_cases = [
+    ('inside', [(2, 2), (8, 2), (8, 8), (2, 8)], [(2, 2), (8, 2), (8, 8), (2, 8)]),
+    ('inside, closed', [(2, 2), (8, 2), (8, 8), (2, 8), (2, 2)], [(2, 2), (8, 2), (8, 8), (2, 8)]),
+    ('outside', [(20, 20), (30, 20), (30, 30)], []),
+    ('outside, bounding box overlapping', [(13, 9), (13, 13), (9, 13)], []),
+    ('crossing an edge', [(5, 2), (15, 2), (15, 8), (5, 8)], [(5, 2), (10, 2), (10, 8), (5, 8)]),
+    ('crossing a corner', [(5, 5), (15, 5), (15, 15), (5, 15)], [(5, 5), (10, 5), (10, 10), (5, 10)]),
+    ('covering the rectangle', [(-5, -5), (15, -5), (15, 15), (-5, 15)], [(0, 0), (10, 0), (10, 10), (0, 10)]),
+    ('triangle over an edge', [(5, 5), (15, 0), (15, 10)], [(5, 5), (10, 2.5), (10, 7.5)]),
+]
+
+# line, expected parts
+line_cases = [
+    ('inside', [(1, 1), (5, 5), (9, 1)], [[(1, 1), (5, 5), (9, 1)]]),
+    ('outside', [(-5, -5), (-1, 20), (20, 20)], []),
+    ('crossing', [(-5, 5), (15, 5)], [[(0, 5), (10, 5)]]),
+    ('leaving and entering again', [(2, 5), (15, 5), (15, 7), (2, 7)], [[(2, 5), (10, 5)], [(10, 7), (2, 7)]]),
+    ('starting outside', [(-5, 2), (5, 2), (5, 8)], [[(0, 2), (5, 2), (5, 8)]]),
+    ('passing a corner outside', [(6, 15), (15, 6)], []),
+    ('through a corner', [(5, 12), (12, 5)], [[(7, 10), (10, 7)]]),
+]
+
+
+def same_polygon(result, expected):
+    if len(expected) == 0:
+        return len(result) == 0
+    if len(result) != len(expected):
+        return False
+    # the start vertex may differ
+    for shift in range(len(result)):
+        if np.allclose(np.roll(result, shift, axis=0), expected):
+            return True
+    return False
+
+
+for name, polygon, expected in polygon_cases:
+    result = geometry.clip_polygon(polygon, rect)
+    fail = None
+    if not isinstance(result, np.ndarray):
+        fail = 'expected numpy.ndarray, got {}'.format(type(result))
+    elif not same_polygon(result, np.array(expected, dtype=np.float64).reshape(-1, 2)):
+        fail = 'expected {}, got {}'.format(expected, result.tolist())
+    else:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for polygon {} ({}): {}'.format(polygon, name, fail)
+
+for name, line, expected in line_cases:
+    result = geometry.clip_polyline(line, rect)
+    fail = None
+    if not isinstance(result, list):
+        fail = 'expected list, got {}'.format(type(result))
+    elif len(result) != len(expected):
+        fail = 'expected {} parts, got {}'.format(len(expected), [part.tolist() for part in result])
+    elif not all(part.shape == (len(part_expected), 2) and np.allclose(part, part_expected)
+                 for part, part_expected in zip(result, expected)):
+        fail = 'expected {}, got {}'.format(expected, [part.tolist() for part in result])
+    else:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for line {} ({}): {}'.format(line, name, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
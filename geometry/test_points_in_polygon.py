@@ -0,0 +1,78 @@
+import random
+
+import numpy as np
+
+import geometry
+
+
+def scalar_point_in_polygon(point, polygon):
+    # the original implementation: cast a ray to the right and count the edges it crosses, one point at a time
+    polygon = np.array(polygon + [polygon[0]] if polygon[0] != polygon[-1] else polygon) - point
+    hits = 0
+    for a, b in zip(polygon[:-1], polygon[1:]):
+        if a[1] > b[1]:
+            b, a = a, b
+        x_over_dy = a[0] * (b - a)[1] - a[1] * (b - a)[0]
+        if a[1] <= 0 < b[1] and 0 <= x_over_dy:
+            hits += 1
+    return hits % 2 == 1
+
+
+def random_polygon(rng: random.Random, count: int):
+    # a star shaped polygon with integer vertices, concave for most counts
+    angles = sorted(rng.uniform(0, 2 * np.pi) for i in range(count))
+    return [(round(50 + rng.uniform(5, 40) * np.cos(a)), round(50 + rng.uniform(5, 40) * np.sin(a))) for a in angles]
+
+
+def boundary_points(polygon):
+    # the vertices, points on the edges and points on the horizontal lines through the vertices
+    out = list(polygon)
+    for (ax, ay), (bx, by) in zip(polygon, polygon[1:] + polygon[:1]):
+        out += [((ax + bx) / 2, (ay + by) / 2), (ax + (bx - ax) / 4, ay + (by - ay) / 4)]
+        out += [(ax - 1, ay), (ax + 1, ay), (ax - 0.5, ay), (ax + 0.5, ay)]
+    return out
+
+
+print('testing geometry.points_in_polygon')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(16)
+
+polygons = [random_polygon(rng, count) for count in (3, 4, 5, 8, 20, 50) for i in range(10)]
+# horizontal and vertical edges, a repeated vertex, a closed ring and a comb with vertices on one line
+polygons += [[(0, 0), (10, 0), (10, 10), (0, 10)], [(0, 0), (10, 0), (10, 0), (10, 10), (0, 10)],
+             [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)],
+             [(0, 0), (10, 0), (10, 10), (8, 5), (6, 10), (4, 5), (2, 10), (0, 5)]]
+for polygon in polygons:
+    points = boundary_points(polygon) + [(rng.uniform(-5, 105), rng.uniform(-5, 105)) for i in range(100)]
+    expected = [scalar_point_in_polygon(point, polygon) for point in points]
+    fail = None
+    for form, polygon_arg in (('list', polygon), ('array', np.array(polygon, dtype=np.float64))):
+        # a small block size splits the points into several blocks
+        for block_size in (1 << 20, 7):
+            result = geometry.points_in_polygon(points, polygon_arg, block_size)
+            if not isinstance(result, np.ndarray) or result.shape != (len(points),):
+                fail = 'expected an array of {} bools, got {}'.format(len(points), result)
+            elif result.tolist() != expected:
+                i = int(np.argmax(result != expected))
+                fail = 'for point {} (polygon as {}) expected {}, got {}'.format(points[i], form, expected[i], result[i])
+            if fail is not None:
+                break
+        if fail is not None:
+            break
+    if fail is None:
+        # the scalar version must agree as well
+        scalar = [geometry.point_in_polygon(point, polygon) for point in points]
+        if scalar != expected:
+            i = [a == b for a, b in zip(scalar, expected)].index(False)
+            fail = 'point_in_polygon for point {} expected {}, got {}'.format(points[i], expected[i], scalar[i])
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for polygon {}: {}'.format(polygon, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
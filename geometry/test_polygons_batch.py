@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+
+import geometry
+
+
+def random_polygon(rng: random.Random, count: int):
+    x, y = rng.uniform(-1000, 1000), rng.uniform(-1000, 1000)
+    angles = sorted(rng.uniform(0, 2 * np.pi) for i in range(count))
+    return [(x + rng.uniform(1, 10) * np.cos(a), y + rng.uniform(1, 10) * np.sin(a)) for a in angles]
+
+
+def batch(polygons):
+    points = np.array([point for polygon in polygons for point in polygon], dtype=np.float64).reshape(-1, 2)
+    return points, np.concatenate([[0], np.cumsum([len(polygon) for polygon in polygons])]).astype(np.intp)
+
+
+def expected_bbox(polygon):
+    polygon = np.array(polygon)
+    return np.concatenate([polygon.min(axis=0), polygon.max(axis=0)])
+
+
+print('testing geometry.polygons_area, geometry.polygons_centroid and geometry.polygons_bbox')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(17)
+
+batches = [
+    [],
+    [random_polygon(rng, 5)],
+    [[(0, 0), (10, 0), (10, 10), (0, 10)]],
+    # closed rings, the repeated first point adds an empty edge
+    [[(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)], [(20, 0), (30, 0), (25, 5), (20, 0)]],
+]
+batches += [[random_polygon(rng, rng.randint(3, 20)) for j in range(count)] for count in (2, 10, 100)
+            for i in range(5)]
+# rings without area: collinear, repeated points, a single point, between normal rings
+degenerate = [[(0, 0), (1, 1), (2, 2)], [(5, 5), (5, 5), (5, 5)], [(3, 4)], [(0, 0), (1, 0)]]
+batches += [degenerate, [random_polygon(rng, 6)] + degenerate + [random_polygon(rng, 4)]]
+
+for polygons in batches:
+    points, offsets = batch(polygons)
+    fail = None
+    area = geometry.polygons_area(points, offsets)
+    centroid = geometry.polygons_centroid(points, offsets)
+    bbox = geometry.polygons_bbox(points, offsets)
+    if area.shape != (len(polygons),) or centroid.shape != (len(polygons), 2) or bbox.shape != (len(polygons), 4):
+        fail = 'expected shapes {}, {} and {}, got {}, {} and {}'.format(
+            (len(polygons),), (len(polygons), 2), (len(polygons), 4), area.shape, centroid.shape, bbox.shape)
+    else:
+        for i, polygon in enumerate(polygons):
+            expected = geometry.polygon_area(polygon)
+            if not np.isclose(area[i], expected, rtol=1e-9, atol=1e-9):
+                fail = 'area of polygon {}: expected {}, got {}'.format(i, expected, area[i])
+            elif not np.array_equal(bbox[i], expected_bbox(polygon)):
+                fail = 'bbox of polygon {}: expected {}, got {}'.format(i, expected_bbox(polygon), bbox[i])
+            elif expected != 0:
+                expected = geometry.polygon_centroid(polygon)
+                if not np.allclose(centroid[i], expected, rtol=1e-9, atol=1e-9):
+                    fail = 'centroid of polygon {}: expected {}, got {}'.format(i, expected, centroid[i])
+            elif np.isfinite(centroid[i]).any():
+                # like polygon_centroid, there is no centroid without area
+                fail = 'centroid of polygon {} without area: expected nan, got {}'.format(i, centroid[i])
+            if fail is not None:
+                break
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for {} polygons: {}'.format(len(polygons), fail)
+
+# an empty polygon in a batch is an error, like for the functions of one polygon
+for function in (geometry.polygons_area, geometry.polygons_centroid, geometry.polygons_bbox):
+    fail = None
+    try:
+        function(np.array([(0, 0), (1, 0), (0, 1)], dtype=np.float64), np.array([0, 3, 3]))
+        fail = 'expected ValueError for an empty polygon'
+    except ValueError:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for {}: {}'.format(function.__name__, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
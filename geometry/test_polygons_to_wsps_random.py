@@ -0,0 +1,114 @@
+import random
+
+import numpy as np
+
+import geometry
+
+
+def scalar_ray_trace(point, polygon):
+    # the original implementation: all edges crossed by a ray to the right, as (x of the crossing, a, b)
+    poly = polygon - point
+    hits = []
+    for i, (a, b) in enumerate(zip(poly[:-1], poly[1:])):
+        if a[1] > b[1]:
+            b, a = a, b
+        x_over_dy = a[0] * (b - a)[1] - a[1] * (b - a)[0]
+        if a[1] <= 0 < b[1] and 0 <= x_over_dy:
+            hits.append((np.array([x_over_dy / (b - a)[1], 0]) + point, i, i + 1))
+    return hits
+
+
+def scalar_polygons_to_wsps(multipolygon):
+    # the original implementation: every polygon is traced against every output polygon
+    polygons = []
+    for polygon in multipolygon:
+        polygon = np.array(polygon + [polygon[0]] if polygon[0] != polygon[-1] else polygon)
+        area = np.dot(polygon[:-1, 0], polygon[1:, 1]) - np.dot(polygon[:-1, 1], polygon[1:, 0])
+        if area < 0:
+            polygon = np.flip(polygon, axis=0)
+        polygon = np.roll(polygon[:-1], -polygon[:-1, 0].argmax(), axis=0)
+        polygons.append(np.concatenate([polygon, [polygon[0]]]))
+    out = []
+    for polygon in sorted(polygons, key=lambda p: p[0, 0], reverse=True):
+        best_hit, best_hit_poly = None, None
+        for poly_out_index, poly_out in enumerate(out):
+            for hit in scalar_ray_trace(polygon[0], poly_out):
+                if best_hit is None or hit[0][0] < best_hit[0][0]:
+                    best_hit, best_hit_poly = hit, poly_out_index
+        if best_hit is not None and out[best_hit_poly][best_hit[1]][1] < out[best_hit_poly][best_hit[2]][1]:
+            out[best_hit_poly] = np.concatenate([out[best_hit_poly][:best_hit[1] + 1], [best_hit[0]], polygon[::-1],
+                                                 [best_hit[0]], out[best_hit_poly][best_hit[2]:]], axis=0)
+        else:
+            out.append(polygon)
+    return [[(x, y) for x, y in polygon] for polygon in out]
+
+
+def circle(rng: random.Random, x: float, y: float, r: float, count: int):
+    phase = rng.random()
+    return [(x + r * np.cos(phase + 2 * np.pi * i / count), y + r * np.sin(phase + 2 * np.pi * i / count))
+            for i in range(count)]
+
+
+def as_floats(wsps):
+    return [[tuple(map(float, point)) for point in polygon] for polygon in wsps]
+
+
+print('testing geometry.polygons_to_wsps against the scalar implementation')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(16)
+
+cases = []
+# outer rings with holes inside (and islands in some holes), in random order and orientation
+for i in range(100):
+    polygons = []
+    for j in range(rng.randint(1, 3)):
+        x, y, r = rng.uniform(0, 100), rng.uniform(0, 100), rng.uniform(10, 30)
+        polygons.append(circle(rng, x, y, r, rng.randint(3, 12)))
+        for k in range(rng.randint(0, 6)):
+            polygons.append(circle(rng, x + rng.uniform(-r / 2, r / 2), y + rng.uniform(-r / 2, r / 2),
+                                   rng.uniform(0.5, r / 5), rng.randint(3, 8)))
+    polygons = [polygon[::-1] if rng.random() < 0.5 else polygon for polygon in polygons]
+    rng.shuffle(polygons)
+    cases.append(polygons)
+# holes touching the outer ring: with their right-most vertex, with an edge and with a vertex on its corner
+square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+cases += [
+    [square, [(10, 5), (7, 4), (7, 6)]],
+    [square, [(10, 4), (10, 6), (7, 5)]],
+    [square, [(10, 10), (7, 8), (8, 7)]],
+    [square, [(0, 5), (3, 4), (3, 6)]],
+    [square, [(5, 0), (6, 3), (4, 3)]],
+    [square, [(10, 5), (7, 4), (7, 6)], [(6, 5), (3, 4), (3, 6)]],
+    [square, [(10, 5), (7, 4), (7, 6)], [(7, 5), (3, 4), (3, 6)]],
+]
+for i in range(50):
+    # a random hole with its right-most vertex on the right edge of the square
+    y = rng.randint(1, 9)
+    hole = [(10, y)] + [(rng.randint(1, 9), rng.randint(1, 9)) for j in range(rng.randint(2, 4))]
+    if geometry.polygon_area(hole) > 0:
+        cases.append([square, hole])
+# a grid of holes sharing y coordinates, their rays hit the same edges
+cases.append([[(0, 0), (100, 0), (100, 100), (0, 100)]] +
+             [[(x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1)] for x in range(5, 95, 10) for y in range(5, 95, 10)])
+
+for polygons in cases:
+    expected = as_floats(scalar_polygons_to_wsps(polygons))
+    result = geometry.polygons_to_wsps(polygons)
+    fail = None
+    if not isinstance(result, list):
+        fail = 'expected list, got {}'.format(type(result))
+    # a bridge may start on an edge split by an earlier bridge, its crossing is then rounded differently
+    elif [len(polygon) for polygon in result] != [len(polygon) for polygon in expected] or \
+            not all(np.allclose(a, b, rtol=0, atol=1e-9) for a, b in zip(as_floats(result), expected)):
+        fail = 'expected {}, got {}'.format(expected, as_floats(result))
+    else:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for polygons {}: {}'.format(polygons, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
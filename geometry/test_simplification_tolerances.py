@@ -0,0 +1,105 @@
+import random
+
+import numpy as np
+
+import geometry
+
+
+def douglas_peucker(points, tolerance):
+    # the classic recursive algorithm, a vertex is kept when its distance is at least the tolerance
+    if len(points) < 3:
+        return list(points)
+    a, b = np.array(points[0]), np.array(points[-1])
+    ab = b - a
+    length = np.dot(ab, ab)
+    best, best_i = -1, 0
+    for i in range(1, len(points) - 1):
+        ap = np.array(points[i]) - a
+        t = min(max(np.dot(ap, ab) / length, 0), 1) if length != 0 else 0
+        d = np.hypot(*(ap - t * ab))
+        if d > best:
+            best, best_i = d, i
+    if best < tolerance:
+        return [points[0], points[-1]]
+    return douglas_peucker(points[:best_i + 1], tolerance)[:-1] + douglas_peucker(points[best_i:], tolerance)
+
+
+def random_line(rng: random.Random, count: int):
+    # a random walk, so there are both small and large deviations
+    x, y, out = 0.0, 0.0, []
+    for i in range(count):
+        x, y = x + rng.uniform(-5, 10), y + rng.uniform(-5, 5)
+        out.append((x, y))
+    return out
+
+
+def random_ring(rng: random.Random, count: int):
+    angles = sorted(rng.uniform(0, 2 * np.pi) for i in range(count))
+    radii = [rng.uniform(5, 10) for i in range(count)]
+    return [(r * np.cos(a), r * np.sin(a)) for a, r in zip(angles, radii)]
+
+
+print('testing geometry.simplification_tolerances')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(4)
+
+lines = [random_line(rng, n) for n in (0, 1, 2, 3, 5, 20, 100) for i in range(5)]
+# collinear and repeated points
+lines += [[(i, 2 * i) for i in range(10)], [(1, 1)] * 5, [(0, 0), (1, 0), (0, 0), (1, 0)]]
+for line in lines:
+    result = geometry.simplification_tolerances(line)
+    fail = None
+    if not isinstance(result, np.ndarray) or result.shape != (len(line),):
+        fail = 'expected an array of {} tolerances, got {}'.format(len(line), result)
+    elif len(line) != 0 and not (np.isinf(result[0]) and np.isinf(result[-1])):
+        fail = 'end points are not always kept: {}'.format(result.tolist())
+    else:
+        for tolerance in (0, 0.1, 0.5, 1, 2, 5, 10, 50, np.inf):
+            expected = douglas_peucker(line, tolerance)
+            simplified = [point for point, keep in zip(line, result >= tolerance) if keep]
+            if simplified != expected:
+                fail = 'at tolerance {} expected {}, got {}'.format(tolerance, expected, simplified)
+                break
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for line {}: {}'.format(line, fail)
+
+# vertices below min_tolerance are not ranked, but larger tolerances give the same result
+for line in lines:
+    result = geometry.simplification_tolerances(line, 2)
+    fail = None
+    for tolerance in (2, 5, 10, 50):
+        expected = douglas_peucker(line, tolerance)
+        simplified = [point for point, keep in zip(line, result >= tolerance) if keep]
+        if simplified != expected:
+            fail = 'with min_tolerance 2 at tolerance {} expected {}, got {}'.format(tolerance, expected, simplified)
+            break
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for line {}: {}'.format(line, fail)
+
+rings = [random_ring(rng, n) for n in (3, 4, 10, 50) for i in range(5)]
+rings += [[(0, 0), (1, 0), (2, 0), (3, 0)], [(0, 0), (0, 0), (0, 0)]]
+for ring in rings:
+    result = geometry.simplification_tolerances(ring, 0.5, ring=True)
+    fail = None
+    kept = np.count_nonzero(result >= np.inf)
+    if kept != 3:
+        fail = 'expected 3 vertices at any tolerance, got {}: {}'.format(kept, result.tolist())
+    elif not (np.isinf(result[0]) and np.isinf(result[-1])):
+        fail = 'end points are not always kept: {}'.format(result.tolist())
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for ring {}: {}'.format(ring, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
@@ -1,74 +1,91 @@
-from collections import namedtuple
-from queue import PriorityQueue
+import heapq
 
 import numpy as np
 
+from geometry import polygons_area, polygons_centroid
 
 # based on: https://blog.mapbox.com/a-new-algorithm-for-finding-a-visual-center-of-a-polygon-7c77e6492fbc
 # ported from JS: https://github.com/mapbox/polylabel/blob/master/polylabel.js
 
-# FIXME multipolygon should be represented as list of innner and outer polygons
-from geometry import point_in_polygon
-
-
-def create_cell(x, y, size_half, multipolygon):
-    center = np.array((x, y))
-
-    # distance from points
-    dist_center = np.sqrt(np.min([np.min(np.sum(np.square(polygon - center), axis=1)) for polygon in multipolygon]))
-
-    # distance to each segment
-    for polygon in multipolygon:
-        for a, b in zip(polygon, np.roll(polygon, -1, axis=0)):
-            if np.dot(center - a, b - a) > 0 and np.dot(center - b, a - b) > 0:
-                dist_center = min(dist_center, abs(np.cross(a - center, b - center) / np.linalg.norm(b - a)))
-
-    # inside?
-    for polygon in multipolygon:
-        if point_in_polygon(center, polygon):
-            dist_center *= -1
-    dist_center *= -1
-
-    dist_max = size_half * (2 ** 0.5) + dist_center
-
-    return namedtuple('Cell', 'dist_max_neg dist_max dist_center size_half x y') \
-        (-dist_max, dist_max, dist_center, size_half, x, y)
-
-
-def polylabel(multipolygon: list):
-    precision = 1.0
-
-    multipolygon = [np.array(polygon) for polygon in multipolygon]
-    minx, miny = np.min([np.min(polygon, axis=0) for polygon in multipolygon], axis=0)
-    maxx, maxy = np.max([np.max(polygon, axis=0) for polygon in multipolygon], axis=0)
+# precision as a fraction of the larger side of the bounding box, a label does not need to be placed more exactly
+_PRECISION = 0.01
+# cells split together, their children are measured in one vectorized call
+_BATCH = 16
+_CORNERS = np.array([(-1, -1), (1, -1), (-1, 1), (1, 1)])
+_SQRT2 = 2 ** 0.5
+
+
+class _Outline:
+    """The segments of all rings, measures the signed distance of many points at once."""
+
+    def __init__(self, multipolygon: list):
+        a = np.concatenate(multipolygon)
+        ends = np.cumsum([len(ring) for ring in multipolygon])
+        following = np.arange(1, len(a) + 1)
+        following[ends - 1] = np.concatenate([[0], ends[:-1]])
+        b = a[following]
+        self.ax, self.ay, self.by = a[:, 0], a[:, 1], b[:, 1]
+        self.dx, self.dy = b[:, 0] - self.ax, self.by - self.ay
+        length = np.square(self.dx) + np.square(self.dy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.inv_length = np.where(length != 0, 1 / length, 0)
+            self.x_per_y = np.where(self.dy != 0, self.dx / self.dy, 0)
+
+    def distance(self, points: np.ndarray):
+        """Distance from each point to the outline, negative outside (even-odd over all rings)."""
+        px, py = points[:, 0, None] - self.ax, points[:, 1, None] - self.ay
+        t = np.clip((px * self.dx + py * self.dy) * self.inv_length, 0, 1)
+        dist = np.sqrt(np.min(np.square(self.dx * t - px) + np.square(self.dy * t - py), axis=1))
+        crosses = ((self.ay > points[:, 1, None]) != (self.by > points[:, 1, None])) & (px < self.x_per_y * py)
+        return np.where(np.count_nonzero(crosses, axis=1) % 2 == 1, dist, -dist)
+
+
+def polylabel(multipolygon: list, precision: float = None):
+    """The point farthest from the outline inside a polygon with holes, given as a list of rings."""
+    multipolygon = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in multipolygon]
+    multipolygon = [ring for ring in multipolygon if len(ring) != 0]
+    points = np.concatenate(multipolygon)
+    (minx, miny), (maxx, maxy) = points.min(axis=0), points.max(axis=0)
     width, height = maxx - minx, maxy - miny
-    cellSize = min(width, height)
-    if cellSize < precision:
+    if precision is None:
+        precision = max(width, height) * _PRECISION
+    cell_size = min(width, height)
+    if cell_size == 0 or cell_size < precision:
         return (minx + maxx) / 2, (miny + maxy) / 2
 
-    queue = PriorityQueue()
-
-    h = cellSize / 2
-    for y in np.arange(miny, maxy, cellSize):
-        for x in np.arange(minx, maxx, cellSize):
-            queue.put(create_cell(x + h, y + h, h, multipolygon))
-
-    # centroid = create_cell_centroid(multipolygon)
-    bbox = create_cell((minx + maxx) / 2, (miny + maxy) / 2, 0, multipolygon)
-    # best = centroid if centroid.dist_center > bbox.dist_center else bbox
-    best = bbox
-
-    while not queue.empty():
-        cell = queue.get()
-        if cell.dist_center > best.dist_center:
-            best = cell
-        if cell.dist_max - best.dist_center <= precision:
-            continue
-        h = cell.size_half / 2
-        x, y = cell.x, cell.y
-        queue.put(create_cell(x - h, y - h, h, multipolygon))
-        queue.put(create_cell(x - h, y + h, h, multipolygon))
-        queue.put(create_cell(x + h, y - h, h, multipolygon))
-        queue.put(create_cell(x + h, y + h, h, multipolygon))
-
-    return best.x, best.y
\ No newline at end of file
+    outline = _Outline(multipolygon)
+    h = cell_size / 2
+    x, y = np.meshgrid(np.arange(minx, maxx, cell_size) + h, np.arange(miny, maxy, cell_size) + h)
+    centers = np.stack([x.ravel(), y.ravel()], axis=1)
+    queue = [(-(d + h * _SQRT2), d, h, x, y) for d, (x, y) in zip(outline.distance(centers).tolist(), centers.tolist())]
+    heapq.heapify(queue)
+
+    # start from the better of the centroid of the largest ring and the center of the bounding box
+    offsets = np.cumsum([0] + [len(ring) for ring in multipolygon])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        start = np.array([polygons_centroid(points, offsets)[polygons_area(points, offsets).argmax()],
+                          ((minx + maxx) / 2, (miny + maxy) / 2)])
+    start = start[np.isfinite(start).all(axis=1)]
+    distance = outline.distance(start)
+    best_d, (best_x, best_y) = distance.max(), start[distance.argmax()].tolist()
+
+    while len(queue) != 0:
+        cells = []
+        while len(queue) != 0 and len(cells) < _BATCH:
+            neg_max, d, h, x, y = heapq.heappop(queue)
+            if d > best_d:
+                best_d, best_x, best_y = d, x, y
+            # the queue is ordered by the best distance a cell could contain, no other cell can do better
+            if -neg_max - best_d <= precision:
+                queue = []
+                break
+            cells.append((h / 2, x, y))
+        if len(cells) == 0:
+            break
+        cells = np.array(cells)
+        children = (cells[None, :, 1:] + _CORNERS[:, None, :] * cells[None, :, :1]).reshape(-1, 2)
+        for d, h, (x, y) in zip(outline.distance(children).tolist(), np.tile(cells[:, 0], 4).tolist(),
+                                children.tolist()):
+            heapq.heappush(queue, (-(d + h * _SQRT2), d, h, x, y))
+
+    return best_x, best_y
@@ -4,7 +4,6 @@ from operator import itemgetter
 from queue import Queue
 from threading import Thread
 from tkinter import ttk, messagebox, filedialog
-from xml.etree import ElementTree
 import sys
 
 from PIL import ImageTk, ImageDraw
@@ -14,7 +13,11 @@ from PIL import Image
 import camera
 from location_filter import Rectangle
 import renderer
+import map_cache
 import osm_helper
+import osm_loader
+import osm_pbf
+import osm_extract
 
 loglevel = 0
 
@@ -28,7 +31,7 @@ def log(*msg, level=0, **kwargs):
 def start():
     global loglevel, arg_parser
     arg_parser = argparse.ArgumentParser(description='OSM Map viewer GUI made by Nulano (2019)')
-    arg_parser.add_argument('-f', '--map', default='maps/bratislava.osm', help='the OpenStreetMap xml file to use', dest='file')
+    arg_parser.add_argument('-f', '--map', default='maps/bratislava.osm', help='the OpenStreetMap file to use (.osm, .osm.gz/.bz2/.xz or .osm.pbf)', dest='file')
     arg_parser.add_argument('-O', '--old-mouse', action='store_const', const=True, default=False, help='use old mouse controls', dest='mouse_old')
     arg_parser.add_argument('-q', action='store_const', const=1, default=0, help='suppress info messages', dest='loglevel')
     arg_parser.add_argument('-Q', action='store_const', const=100, help='suppress ALL messages', dest='loglevel')
@@ -36,13 +39,23 @@ def start():
     arg_parser.add_argument('--center', nargs=2, type=float, help='center map at %(metavar)s at startup', metavar=('LAT', 'LON'))
     arg_parser.add_argument('--zoom', type=int, help='zoom map at level %(metavar)s at startup', metavar='ZOOM')
     arg_parser.add_argument('-F', '--search', help='search for object named %(metavar)s', dest='search_name', metavar='NAME')
+    arg_parser.add_argument('--no-cache', action='store_const', const=False, default=True, help='do not use or create map snapshots', dest='use_cache')
+    arg_parser.add_argument('--node-store', help='keep node coordinates in memory mapped files in %(metavar)s, for maps larger than memory', metavar='DIR')
+    arg_parser.add_argument('--bbox', nargs=4, type=float, help='only load the part of the map inside this bounding box', metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'))
+    arg_parser.add_argument('-j', '--jobs', type=int, help='parse the map using %(metavar)s processes', dest='processes', metavar='N')
     args = arg_parser.parse_args()
 
     loglevel = args.loglevel
     osm_helper.nulano_log = log  # patch osm_helper
+    osm_loader.nulano_log = log  # patch osm_loader
+    osm_pbf.nulano_log = log  # patch osm_pbf
+    osm_extract.nulano_log = log  # patch osm_extract
     renderer.nulano_gui_log = log  # patch renderer
+    map_cache.nulano_log = log  # patch map_cache
 
-    gui = Gui(file=args.file, dimensions=args.dimensions, mouse_old=args.mouse_old)
+    gui = Gui(file=args.file, dimensions=args.dimensions, mouse_old=args.mouse_old,
+              use_cache=args.use_cache, processes=args.processes, node_store=args.node_store,
+              bbox=tuple(args.bbox) if args.bbox is not None else None)
     if args.search_name is not None:
         gui.worker.task_search_name(args.search_name)
     if args.center is not None:
@@ -98,9 +111,10 @@ def show_dialog(root, title, lines: dict, callback, text_submit='OK', text_cance
 
 
 class Gui:
-    def __init__(self, file, dimensions, mouse_old=False):
+    def __init__(self, file, dimensions, mouse_old=False, use_cache=True, processes=None, node_store=None,
+                 bbox=None):
         self.queue_callback = Queue()
-        self.worker = GuiWorker(self)
+        self.worker = GuiWorker(self, dimensions, use_cache, processes, node_store, bbox)
         self.worker.task_load_map(file)
 
         self.root = tk.Tk()
@@ -253,7 +267,9 @@ class Gui:
 
     def menu_file_open(self):
         file = filedialog.askopenfilename(initialdir='maps', title='Open Map...',
-                                          filetypes=(('XML Map File', '*.osm'), ('All Files', '*.*')))
+                                          filetypes=(('XML Map File', '*.osm'),
+                                                     ('Compressed XML Map File', '*.osm.gz *.osm.bz2 *.osm.xz'),
+                                                     ('PBF Map File', '*.pbf'), ('All Files', '*.*')))
         if file:
             self.worker.task_load_map(file)
             self.worker.task_resize(self.root.winfo_width(), self.root.winfo_height())
@@ -328,11 +344,26 @@ def _worker_task(func):
     return wrap
 
 
+def _worker_view_task(func):
+    # moving the view does not wait for the map to load, it is also applied (and partially rendered) while loading
+    def wrap(self, *args, **kwargs):
+        self.queue_view.put(lambda: func(self, *args, **kwargs))
+        self(self._run_view_tasks)
+    return wrap
+
+
 class GuiWorker:
-    def __init__(self, gui):
+    def __init__(self, gui, dimensions, use_cache=True, processes=None, node_store=None, bbox=None):
         self.queue_tasks = Queue()
+        self.queue_view = Queue()
+        self.dimensions = tuple(dimensions)
+        self.loading = False
+        self.rendering = False
+        self.use_cache = use_cache
+        self.processes = processes
+        self.node_store = node_store
+        self.bbox = bbox
 
-        self.element_tree = None
         self.osm_helper = None
         self.camera = None
         self.renderer = None
@@ -343,6 +374,9 @@ class GuiWorker:
 
         self.gui = gui
         renderer.nulano_gui_callback = self._status  # patch renderer
+        osm_loader.nulano_gui_callback = self._status  # patch osm_loader
+        osm_pbf.nulano_gui_callback = self._status  # patch osm_pbf
+        osm_extract.nulano_gui_callback = self._status  # patch osm_extract
 
         # patch base artist:
         try:
@@ -380,6 +414,10 @@ class GuiWorker:
             self.gui.callback_crash(traceback.format_exc())
             raise
 
+    def _run_view_tasks(self):
+        while not self.queue_view.empty():
+            self.queue_view.get(block=False)()
+
     def _status(self, group: str = None, status: str = None, current: int = 0, maximum: int = 0):
         message = None if maximum == 0 else '{}/{}'.format(current, maximum)
 
@@ -393,15 +431,26 @@ class GuiWorker:
             log(message)
 
         self.gui.callback_status(current / maximum if maximum != 0 else current, message)
+
+        # the loader reports progress often, use it to follow the view while the map is loading
+        # (but not in the middle of a frame, the renderer reports its progress too)
+        if self.loading and not self.rendering and not self.queue_view.empty():
+            self._run_view_tasks()
+            if self.renderer is not None:
+                self._render(partial=True)
     
-    def _render(self):
+    def _render(self, partial=False):
         if self.renderer is None:
             self._status('No map file open')
             self.gui.queue_callback.put(self.gui.menu_file_open)
             return
 
         log('-- rendering...')
-        image = self.renderer.render()
+        self.rendering = True
+        try:
+            image = self.renderer.render()
+        finally:
+            self.rendering = False
         image_draw = ImageDraw.Draw(image, 'RGBA')
         if isinstance(self.highlight, tuple):
             x, y = self.renderer.camera.gps_to_px(self.highlight)
@@ -411,7 +460,9 @@ class GuiWorker:
             image_draw.ellipse((self.camera.gps_to_px(a), self.camera.gps_to_px(b)), width=2, outline='#f00')
 
         log('-- rendering done')
-        if self.queue_tasks.empty():
+        if partial:
+            self.gui.callback_render(image)
+        elif self.queue_tasks.empty():
             self.gui.callback_render(image)
             center_deg = self.camera.px_to_gps((self.camera.px_width / 2, self.camera.px_height / 2))
             status = 'lat={0:.4f}, lon={1:.4f}, zoom={2}, px/m={3:.3f}' \
@@ -424,43 +475,56 @@ class GuiWorker:
     @_worker_task
     def task_load_map(self, file):
         try:
-            self.camera = camera.Camera()
+            self.loading = True
+            # partial frames are rendered before the queued tasks run, start with the current canvas size
+            self.camera = camera.Camera(dimensions=self.dimensions)
+            self._run_view_tasks()
 
-            self.element_tree = None
             self.osm_helper = None
             self.renderer = None
+            self.settings = {}
 
             from gc import collect as gc_collect
             gc_collect()
 
             log('-- loading map:', file)
-            self._status(status='parsing xml')
-            self.element_tree = ElementTree.parse(file)
+            loaded = renderer.load_map(self.camera, file, self.use_cache, self.processes, self._show_partial,
+                                       self.node_store, self.bbox)
             gc_collect()
-            self.renderer = renderer.Renderer(self.camera, self.element_tree)
-            try:
-                self.osm_helper = self.renderer.osm_helper
-            except AttributeError:
-                log('Could not find OsmHelper in Renderer, creating a duplicate in Gui', level=2)
-                self.osm_helper = osm_helper.OsmHelper(self.element_tree)
-            self.settings = {}
-            self.renderer.center_camera()
-            self.settings['zoom'] = self.camera.zoom_level
+            # keep the view if it was centered for a partial frame, it may have been moved since
+            if self.renderer is None:
+                loaded.center_camera()
+                self.settings['zoom'] = self.camera.zoom_level
+            self.renderer = loaded
+            self.osm_helper = self.renderer.osm_helper
             self.dirty = True
             log('-- map loaded')
         except FileNotFoundError:
             log('File {} does not exist.'.format(file), level=3)
             log(level=3)
             log('Use "{0} -f FILE" to specify a map file or "{0} -h" to show help.'.format(sys.argv[0]), level=3)
+        finally:
+            self.loading = False
 
-    @_worker_task
+    def _show_partial(self, partial_renderer):
+        if self.renderer is None:
+            self.renderer = partial_renderer
+            self.osm_helper = partial_renderer.osm_helper
+            self.renderer.center_camera()
+            self.settings['zoom'] = self.camera.zoom_level
+        self._run_view_tasks()
+        log('-- rendering partially loaded map')
+        self._render(partial=True)
+
+    @_worker_view_task
     def task_resize(self, width, height):
+        self.dimensions = width, height
         if self.camera.px_width < width or self.camera.px_height < height:
             self.dirty = True
         self.camera.px_width, self.camera.px_height = width, height
 
 
-    @_worker_task
+    @_worker_view_task
     def task_center(self, point):
         self.camera.center_at(*self.camera.px_to_gps(point))
         self.dirty = True
@@ -480,12 +544,12 @@ class GuiWorker:
             self.renderer.center_camera()
         self.dirty = True
 
-    @_worker_task
+    @_worker_view_task
     def task_zoom_in(self, point):
         self.camera.zoom_in(point)
         self.dirty = True
 
-    @_worker_task
+    @_worker_view_task
     def task_zoom_out(self, point):
         self.camera.zoom_out(point)
         self.dirty = True
@@ -511,7 +575,7 @@ class GuiWorker:
             name = osm_helper.tag_dict(element).get('name')
 
         if element.tag == 'node':
-            self.highlight = (float(element.attrib['lat']), float(element.attrib['lon']))
+            self.highlight = self.osm_helper.node_coordinates(element)
             self.camera.center_at(*self.highlight)
             self.selection = name
         else:
@@ -543,7 +607,7 @@ class GuiWorker:
         street, number = street.lower(), number.lower()
         self._status(status='Searching for address: {}, {}'.format(street, number))
         self._select(None)
-        for element in self.element_tree.getroot():
+        for element in self.osm_helper.elements:
             tags = osm_helper.tag_dict(element)
             addr_street, addr_number = tags.get('addr:street', ''), tags.get('addr:housenumber', '')
             address = ' '.join(filter(lambda x: x, [addr_street, addr_number]))
@@ -559,7 +623,7 @@ class GuiWorker:
         self._status(status='Searching for name: {}'.format(target))
         self._select(None)
         best, best_len = None, 1000
-        for element in self.element_tree.getroot():
+        for element in self.osm_helper.elements:
             tags = osm_helper.tag_dict(element)
             names = filter(lambda i: 'name' in i[0], tags.items())
             for key, name in names:
@@ -1,9 +1,11 @@
-from collections import defaultdict
-from math import floor, ceil
+import numpy as np
 
 from osm_helper import OsmHelper
 
-CELL = 0.05
+# entries per node of the R-tree
+_NODE_SIZE = 16
+_CHILDREN = np.arange(_NODE_SIZE)
+_ALL_ZOOMS = 0xffffffff
 
 
 class Rectangle:
@@ -21,28 +23,143 @@ class Rectangle:
         return '[{}, {}, {}, {}]'.format(str(self.min_lat), str(self.min_lon), str(self.max_lat), str(self.max_lon))
 
 
+def _intersects(boxes: np.ndarray, rect: Rectangle):
+    return (boxes[:, 0] <= rect.max_lat) & (rect.min_lat <= boxes[:, 2]) & \
+        (boxes[:, 1] <= rect.max_lon) & (rect.min_lon <= boxes[:, 3])
+
+
+def _difference(a: Rectangle, b: Rectangle):
+    """Rectangles covering the part of a outside of b, a box intersecting a but not b intersects one of them."""
+    if a.min_lat > b.max_lat or b.min_lat > a.max_lat or a.min_lon > b.max_lon or b.min_lon > a.max_lon:
+        return [a]
+    out = []
+    if a.max_lat > b.max_lat:
+        out.append(Rectangle(b.max_lat, a.min_lon, a.max_lat, a.max_lon))
+    if a.min_lat < b.min_lat:
+        out.append(Rectangle(a.min_lat, a.min_lon, b.min_lat, a.max_lon))
+    min_lat, max_lat = max(a.min_lat, b.min_lat), min(a.max_lat, b.max_lat)
+    if a.min_lon < b.min_lon:
+        out.append(Rectangle(min_lat, a.min_lon, max_lat, b.min_lon))
+    if a.max_lon > b.max_lon:
+        out.append(Rectangle(min_lat, b.max_lon, max_lat, a.max_lon))
+    return out
+
+
 class LocationFilter:
+    """A bulk-loaded R-tree of the bounding boxes of draw pairs, packed by Sort-Tile-Recursive into arrays.
+
+    Every level is an array of boxes in tree order, the children of entry i are entries
+    ids[i] * _NODE_SIZE to ids[i] * _NODE_SIZE + _NODE_SIZE of the level below. The tree is rebuilt on the first
+    query after pairs are added.
+
+    Pairs may come with zoom masks, bit z set when the pair is drawn at zoom level z. The masks of the nodes are
+    the union of their children's, so a query at a zoom level skips whole subtrees drawn only at other levels.
+    """
+
     def __init__(self, typical_query_size: float, bounding_box: Rectangle, draw_pairs: list, osm_helper: OsmHelper):
         self.typical_query_size = typical_query_size
         self.bounding_box = bounding_box
-        self.boxes = defaultdict(list)
-        self.unbounded = []
-        self.pairs = draw_pairs
-        for i, (element, artist) in enumerate(draw_pairs):
+        self.unbounded = np.zeros(0, dtype=np.intp)
+        self.pairs = []
+        self.masks = np.zeros(0, dtype=np.uint32)
+        # columns min_lat, min_lon, max_lat, max_lon, a pair may have more boxes
+        self.boxes = np.zeros((0, 4))
+        self.owners = np.zeros(0, dtype=np.intp)
+        self.levels = None
+        self.add(draw_pairs, osm_helper)
+
+    def add(self, draw_pairs: list, osm_helper: OsmHelper, zoom_masks: np.ndarray = None):
+        offset = len(self.pairs)
+        self.pairs += draw_pairs
+        if zoom_masks is None:
+            zoom_masks = np.full(len(draw_pairs), _ALL_ZOOMS, dtype=np.uint32)
+        self.masks = np.concatenate([self.masks, np.asarray(zoom_masks, dtype=np.uint32)])
+        boxes, owners, unbounded = [], [], []
+        for i, (element, artist) in enumerate(draw_pairs, offset):
             location = artist.approx_location(element, osm_helper)
             for bbox in location:
-                for lat in range(floor(bbox.min_lat / CELL), ceil(bbox.max_lat / CELL)):
-                    for lon in range(floor(bbox.min_lon / CELL), ceil(bbox.max_lon / CELL)):
-                        self.boxes[(lat, lon)].append((bbox, i))
+                boxes.append((bbox.min_lat, bbox.min_lon, bbox.max_lat, bbox.max_lon))
+                owners.append(i)
             if len(location) == 0:
-                self.unbounded.append(i)
-
-    def get_pairs(self, rect: Rectangle):
-        out = set(self.unbounded)
-        for lat in range(floor(rect.min_lat / CELL), ceil(rect.max_lat / CELL)):
-            for lon in range(floor(rect.min_lon / CELL), ceil(rect.max_lon / CELL)):
-                for bbox, i in self.boxes[(lat, lon)]:
-                    if max(rect.min_lat, bbox.min_lat) <= min(rect.max_lat, bbox.max_lat) \
-                            and max(rect.min_lon, bbox.min_lon) <= min(rect.max_lon, bbox.max_lon):
-                        out.add(i)
-        return [self.pairs[i] for i in sorted(out)]
+                unbounded.append(i)
+        self.unbounded = np.concatenate([self.unbounded, np.array(unbounded, dtype=np.intp)])
+        if len(boxes) != 0:
+            self.boxes = np.concatenate([self.boxes, np.array(boxes, dtype=np.float64)])
+            self.owners = np.concatenate([self.owners, np.array(owners, dtype=np.intp)])
+            self.levels = None
+
+    @staticmethod
+    def _pack(boxes: np.ndarray):
+        # Sort-Tile-Recursive: vertical slices by longitude, then latitude within each slice
+        nodes = -(-len(boxes) // _NODE_SIZE)
+        slice_size = int(np.ceil(np.sqrt(nodes))) * _NODE_SIZE
+        by_lon = np.argsort(boxes[:, 1] + boxes[:, 3], kind='stable')
+        slices = np.arange(len(boxes)) // slice_size
+        return by_lon[np.lexsort(((boxes[by_lon, 0] + boxes[by_lon, 2]), slices))]
+
+    def _build(self):
+        # levels from the root down, as (boxes, ids, masks)
+        levels = []
+        boxes, ids, masks = self.boxes, np.arange(len(self.boxes)), self.masks[self.owners]
+        while True:
+            order = self._pack(boxes)
+            boxes, ids, masks = boxes[order], ids[order], masks[order]
+            levels.append((boxes, ids, masks))
+            if len(boxes) <= _NODE_SIZE:
+                break
+            starts = np.arange(0, len(boxes), _NODE_SIZE)
+            boxes = np.concatenate([np.minimum.reduceat(boxes[:, :2], starts),
+                                    np.maximum.reduceat(boxes[:, 2:], starts)], axis=1)
+            ids, masks = np.arange(len(boxes)), np.bitwise_or.reduceat(masks, starts)
+        self.levels = levels[::-1]
+        # the boxes of pair i are boxes[by_owner[owner_offsets[i]:owner_offsets[i + 1]]]
+        self.by_owner = np.argsort(self.owners, kind='stable')
+        self.owner_offsets = np.searchsorted(self.owners[self.by_owner], np.arange(len(self.pairs) + 1))
+
+    def _boxes_in(self, rect: Rectangle, bit: np.uint32):
+        # indices of the boxes intersecting rect with the zoom bit set
+        if self.levels is None:
+            self._build()
+        # entries of the current level to test, all of the root
+        candidates = np.arange(len(self.levels[0][0]))
+        for depth, (boxes, ids, masks) in enumerate(self.levels):
+            if depth != 0:
+                candidates = (candidates[:, None] * _NODE_SIZE + _CHILDREN).ravel()
+                candidates = candidates[candidates < len(boxes)]
+            candidates = ids[candidates[_intersects(boxes[candidates], rect) & (masks[candidates] & bit != 0)]]
+        return candidates
+
+    def _pairs_intersect(self, pairs: np.ndarray, rect: Rectangle):
+        # whether any box of each of the (bounded) pairs intersects rect
+        starts, counts = self.owner_offsets[pairs], np.diff(self.owner_offsets)[pairs]
+        first = np.cumsum(counts) - counts
+        boxes = self.by_owner[np.arange(counts.sum()) - np.repeat(first - starts, counts)]
+        return np.logical_or.reduceat(_intersects(self.boxes[boxes], rect), first)
+
+    def get_indices(self, rect: Rectangle, zoom: int = None):
+        """Sorted indices of the pairs whose boxes intersect rect, only those drawn at the zoom level if it is given."""
+        bit = np.uint32(_ALL_ZOOMS if zoom is None else 1 << zoom)
+        unbounded = self.unbounded[self.masks[self.unbounded] & bit != 0]
+        if len(self.boxes) == 0:
+            return unbounded
+        return np.union1d(self.owners[self._boxes_in(rect, bit)], unbounded)
+
+    def get_pairs(self, rect: Rectangle, zoom: int = None):
+        return [self.pairs[i] for i in self.get_indices(rect, zoom).tolist()]
+
+    def get_delta(self, old: Rectangle, new: Rectangle, zoom: int = None):
+        """Indices of the pairs entering and leaving the view when it moves from old to new.
+
+        Only the parts of one rectangle not covered by the other are searched, so a small move is cheap.
+        """
+        if len(self.boxes) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        bit = np.uint32(_ALL_ZOOMS if zoom is None else 1 << zoom)
+        out = []
+        for a, b in ((new, old), (old, new)):
+            strips = [self._boxes_in(strip, bit) for strip in _difference(a, b)]
+            pairs = np.unique(self.owners[np.concatenate([np.zeros(0, dtype=np.intp)] + strips)])
+            if len(pairs) != 0:
+                pairs = pairs[self._pairs_intersect(pairs, a) & ~self._pairs_intersect(pairs, b)]
+            out.append(pairs)
+        return out[0], out[1]
@@ -1,4 +1,6 @@
-from location_filter import Rectangle, LocationFilter
+import random
+
+from location_filter import Rectangle, LocationFilter, _NODE_SIZE
 
 
 
@@ -69,3 +71,78 @@ with open('testdata/input.in', 'r') as f:
 print('Should have found {} pairs'.format(expected_count))
 print('Found {} pairs [{} times more]'.format(found_count, found_count/expected_count))
 print('Failed to find {} pairs [{} of all]'.format(failed_to_find, failed_to_find/expected_count))
+
+
+def random_box(rng: random.Random, size: float):
+    # a point or a line in some cases, boxes of these are drawn too
+    lat, lon = rng.uniform(0, 100), rng.uniform(0, 100)
+    kind = rng.random()
+    if kind < 0.1:
+        return Rectangle(lat, lon, lat, lon)
+    if kind < 0.2:
+        return Rectangle(lat, lon, lat + rng.uniform(0, size), lon)
+    return Rectangle(lat, lon, lat + rng.uniform(0, size), lon + rng.uniform(0, size))
+
+
+def linear_scan(objects, masks, rect: Rectangle, zoom):
+    # every pair without a box, or with a box touching rect, drawn at the zoom level
+    out = []
+    for i, (obj, mask) in enumerate(zip(objects, masks)):
+        if zoom is not None and not mask >> zoom & 1:
+            continue
+        if len(obj) == 0 or any(box.min_lat <= rect.max_lat and rect.min_lat <= box.max_lat and
+                                box.min_lon <= rect.max_lon and rect.min_lon <= box.max_lon for box in obj):
+            out.append(i)
+    return out
+
+
+print('testing location_filter.LocationFilter.get_pairs against a linear scan')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(23)
+
+# no pairs, a single leaf, exactly one full leaf, a few levels and many boxes per pair
+for count in [0, 1, 5, _NODE_SIZE - 1, _NODE_SIZE, _NODE_SIZE + 1, 100, 300, 2000]:
+    for trial in range(3):
+        objects = [[random_box(rng, rng.choice((0.1, 1, 10))) for k in range(rng.choice((0, 1, 1, 1, 2, 4)))]
+                   for j in range(count)]
+        masks = [rng.getrandbits(20) | 1 << rng.randrange(20) for j in range(count)]
+        # pairs are added in two batches, with and without zoom masks, and a query is made in between
+        split = count // 2
+        filt = LocationFilter(1, Rectangle(0, 0, 100, 100), [(obj, Dummy(j)) for j, obj in enumerate(objects[:split])],
+                              None)
+        masks[:split] = [0xffffffff] * split
+        filt.get_indices(Rectangle(0, 0, 100, 100))
+        filt.add([(obj, Dummy(j)) for j, obj in enumerate(objects[split:], split)], None, masks[split:])
+
+        queries = [random_box(rng, rng.choice((0.1, 1, 10, 50))) for j in range(30)]
+        queries += [Rectangle(0, 0, 100, 100), Rectangle(-10, -10, -5, -5), Rectangle(200, 200, 300, 300)]
+        # queries exactly touching a box on its edge or corner
+        queries += [Rectangle(box.max_lat, box.max_lon, box.max_lat + 1, box.max_lon + 1)
+                    for obj in objects[:5] for box in obj]
+        queries += [Rectangle(box.min_lat - 1, box.min_lon, box.min_lat, box.min_lon) for obj in objects[:5] for box in obj]
+        fail = None
+        for rect in queries:
+            for zoom in (None, 0, rng.randrange(20)):
+                expected = linear_scan(objects, masks, rect, zoom)
+                indices = filt.get_indices(rect, zoom)
+                pairs = filt.get_pairs(rect, zoom)
+                if indices.tolist() != expected:
+                    fail = 'get_indices({}, {}): expected {}, got {}'.format(rect, zoom, expected, indices.tolist())
+                elif [pair[1].id for pair in pairs] != expected:
+                    fail = 'get_pairs({}, {}): expected {}, got {}'.format(rect, zoom, expected,
+                                                                       [pair[1].id for pair in pairs])
+                if fail is not None:
+                    break
+            if fail is not None:
+                break
+        if fail is None:
+            correct_tests += 1
+        test_count += 1
+        if failure is None and fail is not None:
+            failure = 'for {} pairs: {}'.format(count, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
@@ -0,0 +1,77 @@
+from collections import defaultdict
+from typing import List, Tuple
+
+import numpy as np
+
+_OUTER_ROLES = ('outer', '')
+
+
+def assemble_rings(ways: list):
+    """Joins ways (arrays of node ids) at their end nodes into closed rings, in linear time.
+
+    Returns the rings and the ways which could not be closed.
+    """
+    rings, open_ways = [], []
+    ends = defaultdict(list)
+    for way in ways:
+        way = np.asarray(way, dtype=np.int64)
+        if len(way) < 2:
+            continue
+        if way[0] == way[-1]:
+            rings.append(way)
+        else:
+            ends[int(way[0])].append(len(open_ways))
+            ends[int(way[-1])].append(len(open_ways))
+            open_ways.append(way)
+
+    used = [False] * len(open_ways)
+    leftover = []
+    for start, way in enumerate(open_ways):
+        if used[start]:
+            continue
+        used[start] = True
+        chain, pieces = [way], [way]
+        first, last = int(way[0]), int(way[-1])
+        while last != first:
+            for i in ends[last]:
+                if not used[i]:
+                    used[i] = True
+                    way = open_ways[i]
+                    break
+            else:
+                break
+            chain.append(way)
+            if way[0] != last:
+                way = way[::-1]
+            pieces.append(way[1:])
+            last = int(way[-1])
+        if last == first:
+            rings.append(np.concatenate(pieces))
+        else:
+            leftover += chain
+    return rings, leftover
+
+
+def assemble_multipolygon(members: List[Tuple[str, np.ndarray]]):
+    """Assembles the outer and inner ways of a multipolygon separately, then tries again with the ways left over
+    (roles are not always tagged correctly).
+
+    Returns a list of (role, ring) and the number of ways which could not be closed.
+    """
+    by_role = defaultdict(list)
+    for role, way in members:
+        by_role['outer' if role in _OUTER_ROLES else 'inner'].append(way)
+    out, leftover = [], []
+    for role in ('outer', 'inner'):
+        rings, left = assemble_rings(by_role[role])
+        out += [(role, ring) for ring in rings]
+        leftover += left
+    if len(leftover) != 0:
+        rings, leftover = assemble_rings(leftover)
+        out += [('', ring) for ring in rings]
+    return out, len(leftover)
+
+
+def assemble_multipolygons(multipolygons: list):
+    """Assembles a batch of (id, members), suitable for a process pool."""
+    return [(id,) + assemble_multipolygon(members) for id, members in multipolygons]
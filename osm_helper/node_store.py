@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+# OSM stores coordinates with 7 decimal places
+_SCALE = 1e7
+_FILES = ('ids', 'lat', 'lon')
+_CHUNK = 1 << 20
+
+
+class NodeStore:
+    def __init__(self, ids, lat, lon):
+        ids = np.asarray(ids, dtype=np.int64)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        # .osm files are usually sorted by id, only sort when necessary
+        if len(ids) > 1 and np.any(ids[1:] < ids[:-1]):
+            order = np.argsort(ids, kind='stable')
+            ids, lat, lon = ids.take(order), lat.take(order), lon.take(order)
+        self.ids = ids
+        self.lat = lat
+        self.lon = lon
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        index = np.searchsorted(self.ids, id)
+        return index < len(self.ids) and self.ids[index] == id
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __getitem__(self, id):
+        index = self.index([id])[0]
+        return float(self.lat[index]), float(self.lon[index])
+
+    def index(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0 and len(ids) != 0:
+            raise KeyError(int(ids[0]))
+        index = np.searchsorted(self.ids, ids)
+        found = self.ids.take(index, mode='clip') == ids
+        if not found.all():
+            raise KeyError(int(ids[np.argmin(found)]))
+        return index
+
+    def coordinates(self, ids):
+        index = self.index(ids)
+        return np.stack((self.lat.take(index), self.lon.take(index)), axis=-1)
+
+    def bounds(self):
+        return float(self.lat.min()), float(self.lon.min()), float(self.lat.max()), float(self.lon.max())
+
+    def chunks(self, size: int = _CHUNK):
+        """Yields (ids, lat, lon) arrays of at most size nodes each, in id order."""
+        for begin in range(0, len(self.ids), size):
+            yield self.ids[begin:begin + size], self.lat[begin:begin + size], self.lon[begin:begin + size]
+
+
+class MappedNodeStore(NodeStore):
+    """Sorted node ids and quantized coordinates in memory mapped files, for maps larger than memory.
+
+    Coordinates are only available through lookups and chunks(), there are no lat/lon arrays for the whole map.
+    """
+
+    def __init__(self, path: str, count: int):
+        self.path = path
+        if count == 0:
+            # empty files can not be mapped
+            self.ids, self._lat, self._lon = np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32)
+        else:
+            self.ids, self._lat, self._lon = (np.memmap(os.path.join(path, name), dtype=dtype, mode='r', shape=(count,))
+                                              for name, dtype in zip(_FILES, (np.int64, np.int32, np.int32)))
+
+    def __getitem__(self, id):
+        index = self.index([id])[0]
+        return float(self._lat[index] / _SCALE), float(self._lon[index] / _SCALE)
+
+    def coordinates(self, ids):
+        index = self.index(ids)
+        return np.stack((self._lat.take(index) / _SCALE, self._lon.take(index) / _SCALE), axis=-1)
+
+    def bounds(self):
+        return (float(self._lat.min() / _SCALE), float(self._lon.min() / _SCALE),
+                float(self._lat.max() / _SCALE), float(self._lon.max() / _SCALE))
+
+    def chunks(self, size: int = _CHUNK):
+        for begin in range(0, len(self.ids), size):
+            yield (np.array(self.ids[begin:begin + size]),
+                   self._lat[begin:begin + size] / _SCALE, self._lon[begin:begin + size] / _SCALE)
+
+
+class NodeFileWriter:
+    """Writes nodes to the files of a MappedNodeStore. Nodes must be written in ascending id order, as in sorted
+    .osm and .pbf files; sorting them afterwards would need the whole table in memory."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='nodes-', dir=directory)
+        self.files = [open(os.path.join(self.path, name), 'wb') for name in _FILES]
+        self.count = 0
+        self.last_id = None
+
+    def write(self, ids, lat, lon):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        if np.any(ids[1:] < ids[:-1]) or (self.last_id is not None and ids[0] < self.last_id):
+            self.close()
+            raise ValueError('nodes are not sorted by id, a disk-backed node store needs a sorted map '
+                             '(e.g. osmium sort)')
+        ids_file, lat_file, lon_file = self.files
+        ids_file.write(ids.tobytes())
+        lat_file.write(np.rint(np.asarray(lat) * _SCALE).astype(np.int32).tobytes())
+        lon_file.write(np.rint(np.asarray(lon) * _SCALE).astype(np.int32).tobytes())
+        self.count += len(ids)
+        self.last_id = int(ids[-1])
+
+    def close(self):
+        """Discards the files written so far."""
+        for f in self.files:
+            f.close()
+        shutil.rmtree(self.path, True)
+
+    def finish(self):
+        for f in self.files:
+            f.close()
+        store = MappedNodeStore(self.path, self.count)
+        # mapped files stay readable after they are removed on POSIX, elsewhere they are removed on exit
+        weakref.finalize(store, shutil.rmtree, self.path, True)
+        return store
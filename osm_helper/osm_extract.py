@@ -0,0 +1,171 @@
+import argparse
+import os
+from collections import defaultdict
+from importlib import import_module
+from typing import Union
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from osm_loader import OsmData, iter_fragments, _COMPRESSION
+
+
+# fallback for incompatible gui implementations
+def nulano_log(*msg, level=0):
+    print(*msg)
+
+
+# fallback for incompatible gui implementations
+def nulano_gui_callback(group: str = 'info', status: str = 'unknown', current: Union[int, float] = 0, maximum: int = 0):
+    print('{}: {}/{}, ({})'.format(group, current, maximum, status))
+
+
+def _any_per_way(hits: np.ndarray, lengths: np.ndarray):
+    out = np.zeros(len(lengths), dtype=bool)
+    nonempty = lengths != 0
+    if hits.size != 0:
+        out[nonempty] = np.logical_or.reduceat(hits, np.cumsum(lengths)[nonempty] - lengths[nonempty])
+    return out
+
+
+def _multipolygons(fragment: OsmData):
+    tags, ids = np.frombuffer(fragment._element_tags, dtype=np.int8), np.frombuffer(fragment._element_ids, dtype=np.int64)
+    return {id for i, id in zip(np.flatnonzero(tags == 2).tolist(), ids[tags == 2].tolist())
+            if fragment.tags[i].get('type') == 'multipolygon'}
+
+
+def _select(file: str, bbox: tuple, processes: int = None):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    inside = [np.zeros(0, dtype=np.int64)]
+    ways, way_refs, relations = set(), [], set()
+    # relations are resolved after the pass, a relation may refer to one further in the file
+    parents, member_ways, multipolygons = defaultdict(list), {}, set()
+    for fragment in iter_fragments(file, processes):
+        ids = np.frombuffer(fragment._node_ids, dtype=np.int64)
+        lat = np.frombuffer(fragment._node_lat, dtype=np.float64)
+        lon = np.frombuffer(fragment._node_lon, dtype=np.float64)
+        inside.append(ids[(min_lat <= lat) & (lat <= max_lat) & (min_lon <= lon) & (lon <= max_lon)])
+        if len(fragment.ways) == 0 and len(fragment.relations) == 0:
+            continue
+        # nodes come before ways and relations, so this rarely happens more than once
+        if len(inside) > 1:
+            inside = [np.unique(np.concatenate(inside))]
+
+        if len(fragment.ways) != 0:
+            lengths = np.fromiter(map(len, fragment.ways.values()), dtype=np.int64, count=len(fragment.ways))
+            refs = np.concatenate([np.asarray(refs, dtype=np.int64) for refs in fragment.ways.values()])
+            for (id, refs), keep in zip(fragment.ways.items(), _any_per_way(np.isin(refs, inside[0]), lengths)):
+                if keep:
+                    ways.add(id)
+                    way_refs.append(np.asarray(refs, dtype=np.int64))
+
+        multipolygons |= _multipolygons(fragment)
+        for id, members in fragment.relations.items():
+            node_refs = [ref for member_type, ref, role in members if member_type == 'node']
+            if np.isin(node_refs, inside[0]).any() or \
+                    any(member_type == 'way' and ref in ways for member_type, ref, role in members):
+                relations.add(id)
+            for member_type, ref, role in members:
+                if member_type == 'relation':
+                    parents[ref].append(id)
+            if id in multipolygons:
+                member_ways[id] = [ref for member_type, ref, role in members if member_type == 'way']
+
+    # a relation with a selected member relation is selected as well, up to the top
+    queue = list(relations)
+    while len(queue) != 0:
+        for parent in parents.pop(queue.pop(), ()):
+            if parent not in relations:
+                relations.add(parent)
+                queue.append(parent)
+
+    # the rings of multipolygons crossing the border need their ways outside of the box
+    missing = {ref for id in relations & member_ways.keys() for ref in member_ways[id]} - ways
+    if len(missing) != 0:
+        nulano_gui_callback(group='loading map', status='completing multipolygons crossing the bounding box', current=1)
+        for fragment in iter_fragments(file, processes):
+            for id in missing & fragment.ways.keys():
+                ways.add(id)
+                way_refs.append(np.asarray(fragment.ways[id], dtype=np.int64))
+
+    # complete the ways crossing the border with their nodes outside of the box
+    nodes = np.unique(np.concatenate(inside + way_refs))
+    return nodes, ways, relations
+
+
+def load_osm_bbox(file: str, bbox: tuple, processes: int = None, node_store: str = None):
+    """Loads only the part of the map in bbox, in two passes over the file.
+
+    Elements touching the box are loaded with all of their nodes, relations with a member touching it and the
+    relations containing those. Multipolygons are loaded with all of their ways, which takes a third pass when
+    some of them cross the border of the box.
+    """
+    nulano_gui_callback(group='loading map', status='selecting elements in bounding box', current=1, maximum=2)
+    nodes, ways, relations = _select(file, bbox, processes)
+    nulano_gui_callback(group='loading map', status='loading elements in bounding box', current=2, maximum=2)
+    data = OsmData(node_store)
+    for fragment in iter_fragments(file, processes):
+        data.extend(fragment.select(nodes, ways, relations))
+    data.bounds = tuple(bbox)
+    data.finish()
+    nulano_log('loaded {} nodes, {} ways, {} relations ({} tagged) in bounding box'
+               .format(len(data.nodes), len(data.ways), len(data.relations), len(data.elements)))
+    return data
+
+
+def _open_output(file: str):
+    extension = os.path.splitext(file)[1]
+    if extension in _COMPRESSION:
+        return import_module(_COMPRESSION[extension]).open(file, 'wt', encoding='utf-8')
+    return open(file, 'w', encoding='utf-8')
+
+
+def _write_tags(f, tags):
+    for key, value in tags.items():
+        f.write('    <tag k={} v={}/>\n'.format(quoteattr(key), quoteattr(value)))
+
+
+def write_osm(data: OsmData, file: str):
+    node_tags = {element.id: element.tags for element in data.elements if element.tag == 'node'}
+    tags = {(element.tag, element.id): element.tags for element in data.elements if element.tag != 'node'}
+    with _open_output(file) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="osm_extract">\n')
+        if data.bounds is not None:
+            f.write('  <bounds minlat="{:.7f}" minlon="{:.7f}" maxlat="{:.7f}" maxlon="{:.7f}"/>\n'.format(*data.bounds))
+        for ids, lat, lon in data.nodes.chunks():
+            for id, lat, lon in zip(ids.tolist(), lat.tolist(), lon.tolist()):
+                node = '  <node id="{}" lat="{:.7f}" lon="{:.7f}"'.format(id, lat, lon)
+                if id in node_tags:
+                    f.write(node + '>\n')
+                    _write_tags(f, node_tags[id])
+                    f.write('  </node>\n')
+                else:
+                    f.write(node + '/>\n')
+        for id, refs in data.ways.items():
+            f.write('  <way id="{}">\n'.format(id))
+            f.writelines('    <nd ref="{}"/>\n'.format(ref) for ref in np.asarray(refs).tolist())
+            _write_tags(f, tags.get(('way', id), {}))
+            f.write('  </way>\n')
+        for id, members in data.relations.items():
+            f.write('  <relation id="{}">\n'.format(id))
+            f.writelines('    <member type="{}" ref="{}" role={}/>\n'.format(member_type, ref, quoteattr(role))
+                         for member_type, ref, role in members)
+            _write_tags(f, tags.get(('relation', id), {}))
+            f.write('  </relation>\n')
+        f.write('</osm>\n')
+
+
+def extract(file: str, output: str, bbox: tuple, processes: int = None, node_store: str = None):
+    write_osm(load_osm_bbox(file, bbox, processes, node_store), output)
+    nulano_log('wrote', output)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Extract the part of an OpenStreetMap file inside a bounding box.')
+    arg_parser.add_argument('input', help='the map to read (.osm, .osm.gz/.bz2/.xz or .osm.pbf)')
+    arg_parser.add_argument('output', help='the .osm file to write, compressed if it ends with .gz, .bz2 or .xz')
+    arg_parser.add_argument('--bbox', required=True, nargs=4, type=float, help='the area to extract', metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'))
+    arg_parser.add_argument('-j', '--jobs', type=int, help='parse the map using %(metavar)s processes', dest='processes', metavar='N')
+    arg_parser.add_argument('--node-store', help='keep node coordinates in memory mapped files in %(metavar)s', metavar='DIR')
+    args = arg_parser.parse_args()
+    extract(args.input, args.output, tuple(args.bbox), args.processes, args.node_store)
@@ -1,8 +1,19 @@
-from queue import Queue
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import Union
 from weakref import WeakKeyDictionary
 from xml.etree.ElementTree import ElementTree, Element
 
+import numpy as np
+
 import geometry
+from multipolygon import assemble_multipolygon, assemble_multipolygons
+from osm_loader import OsmData, OsmElement, read_element_tree
+
+# below this many multipolygons, starting a process pool costs more than it saves
+_PARALLEL_MULTIPOLYGONS = 4096
+_MULTIPOLYGON_CHUNK = 1024
 
 
 # fallback for incompatible gui implementations
@@ -11,6 +22,8 @@ def nulano_log(*msg, level=0):
 
 
 def tag_dict(element: Element):
+    if isinstance(element, OsmElement):
+        return element.tags
     out = {}
     for el in element:
         if el.tag == 'tag':
@@ -18,6 +31,10 @@ def tag_dict(element: Element):
     return out
 
 
+def searchable(tags: dict):
+    return any('name' in key or key.startswith('addr:') for key in tags)
+
+
 def _memoize(func):
     def memoized(osm_helper, element: Element, cache=WeakKeyDictionary()):
         try:
@@ -29,25 +46,62 @@ def _memoize(func):
     return memoized
 
 
+class _NodeView(Mapping):
+    def __init__(self, osm_data: OsmData):
+        self.osm_data = osm_data
+
+    def __getitem__(self, id):
+        id = int(id)
+        if id not in self.osm_data.nodes:
+            raise KeyError(id)
+        return OsmElement('node', id, {})
+
+    def __iter__(self):
+        return map(str, self.osm_data.nodes.ids.tolist())
+
+    def __len__(self):
+        return len(self.osm_data.nodes)
+
+
 class OsmHelper:
-    def __init__(self, element_tree: ElementTree):
-        self.element_tree = element_tree
-        self.nodes = {}
-        for nd in element_tree.getroot():
-            if nd.tag == 'node':
-                self.nodes[nd.attrib['id']] = nd
-        self.ways = {}
-        for way in element_tree.getroot():
-            if way.tag == 'way':
-                self.ways[way.attrib['id']] = way
+    def __init__(self, osm_data: Union[OsmData, ElementTree]):
+        if isinstance(osm_data, ElementTree):
+            self.nodes = {nd.attrib['id']: nd for nd in osm_data.getroot() if nd.tag == 'node'}
+            osm_data = read_element_tree(osm_data)
+        else:
+            self.nodes = _NodeView(osm_data)
+        self.osm_data = osm_data
+        self.ways = osm_data.ways
+        self.relations = osm_data.relations
+        # relation id -> (rings of node ids, unconnected way count), until the coordinates are looked up
+        self.rings = {}
+
+    @property
+    def elements(self):
+        return self.osm_data.elements
+
+    def prune(self, drawn: set):
+        data = self.osm_data
+        before = data.memory_usage(), len(data.nodes), len(data.ways), len(data.relations), len(data.elements)
+        data.prune([element for element in data.elements if element in drawn or searchable(tag_dict(element))])
+        self.ways = data.ways
+        self.relations = data.relations
+        self.rings = {id: rings for id, rings in self.rings.items() if id in self.relations}
+        after = data.memory_usage(), len(data.nodes), len(data.ways), len(data.relations), len(data.elements)
+        freed = [a - b for a, b in zip(before, after)]
+        nulano_log('pruned {1} nodes, {2} ways, {3} relations and {4} tagged elements, freed about {0:.1f} MB'
+                   .format(freed[0] / 1e6, *freed[1:]))
+
+    def node_coordinates(self, node: Element):
+        return self.osm_data.nodes[int(node.get('id'))]
+
+    def way_refs(self, way: Element):
+        if way.tag != 'way':
+            return ()
+        return self.ways[int(way.get('id'))]
 
-    @_memoize
     def way_node_ids(self, way: Element):
-        out = []
-        for el in way:
-            if el.tag == 'nd':
-                out.append(el.attrib['ref'])
-        return out
+        return [str(ref) for ref in self.way_refs(way)]
 
     def way_nodes_for_ids(self, way: list):
         return [self.nodes[n] for n in way]
@@ -56,64 +110,80 @@ class OsmHelper:
         return self.way_nodes_for_ids(self.way_node_ids(way))
 
     def way_coordinates_for_nodes(self, way: list):
-        return [(float(nd.attrib['lat']), float(nd.attrib['lon'])) for nd in way]
+        return [self.node_coordinates(nd) for nd in way]
 
     def way_coordinates_for_ids(self, way: list):
-        return self.way_coordinates_for_nodes(self.way_nodes_for_ids(way))
+        return list(map(tuple, self.osm_data.nodes.coordinates(list(map(int, way))).tolist()))
 
     @_memoize
+    def way_coordinates_array(self, way: Element):
+        return self.osm_data.nodes.coordinates(self.way_refs(way))
+
     def way_coordinates(self, way: Element):
-        return self.way_coordinates_for_nodes(self.way_nodes(way))
+        return list(map(tuple, self.way_coordinates_array(way).tolist()))
+
+    def multipolygon_way_coordinates(self, multipolygon: Element):
+        out = []
+        for member_type, ref, role in self.relations[int(multipolygon.get('id'))]:
+            if member_type == 'way' and ref in self.ways:
+                try:
+                    out.append(self.osm_data.nodes.coordinates(self.ways[ref]))
+                except KeyError:
+                    pass
+        return out
+
+    def _multipolygon_members(self, id: int):
+        out = []
+        for member_type, ref, role in self.relations[id]:
+            if member_type == 'way':
+                way = self.ways.get(ref)
+                if way is None:
+                    nulano_log('multipolygon {} is missing way {}'.format(id, ref), level=1)
+                else:
+                    out.append((role, way))
+        return out
+
+    def assemble_multipolygons(self, processes: int = None):
+        """Assembles the rings of all multipolygons in one pass, in parallel for large maps."""
+        multipolygons = [(element.id, self._multipolygon_members(element.id)) for element in self.elements
+                         if element.tag == 'relation' and element.tags.get('type') == 'multipolygon'
+                         and element.id not in self.rings]
+        if processes is not None and processes > 1 and len(multipolygons) >= _PARALLEL_MULTIPOLYGONS:
+            chunks = [multipolygons[i:i + _MULTIPOLYGON_CHUNK]
+                      for i in range(0, len(multipolygons), _MULTIPOLYGON_CHUNK)]
+            with ProcessPoolExecutor(processes) as pool:
+                results = [result for chunk in pool.map(assemble_multipolygons, chunks) for result in chunk]
+        else:
+            results = assemble_multipolygons(multipolygons)
+        for id, rings, unconnected in results:
+            self.rings[id] = rings, unconnected
+
+    def multipolygon_rings(self, multipolygon: Element):
+        """Returns a list of (role, node ids) for the closed rings of a multipolygon."""
+        element_type = tag_dict(multipolygon).get('type', None)
+        if element_type != 'multipolygon':
+            raise ValueError('invalid multipolygon: {}[{}].type={}'
+                             .format(multipolygon.tag, multipolygon.get('id'), element_type))
+        id = int(multipolygon.get('id'))
+        # the rings are only needed until the memoized coordinates exist
+        rings = self.rings.pop(id, None)
+        if rings is None:
+            rings = assemble_multipolygon(self._multipolygon_members(id))
+        rings, unconnected = rings
+        if unconnected != 0:
+            nulano_log('multipolygon {} has {} unconnected way(s)'.format(id, unconnected), level=1)
+        return rings
 
     @_memoize
     def multipolygon_to_polygons(self, multipolygon: Element):
         try:
-            out = []
-            element_type = tag_dict(multipolygon).get('type', None)
-            if element_type != 'multipolygon':
-                raise ValueError('invalid multipolygon: {}[{}].type={}'
-                                 .format(multipolygon.tag, multipolygon.attrib['id'], element_type))
-            ways = Queue()
-            for el in multipolygon:
-                if el.tag == 'member' and el.attrib['type'] == 'way':
-                    way = self.ways.get(el.attrib['ref'])
-                    if way is None:
-                        nulano_log('multipolygon {} is missing way {}'
-                                   .format(multipolygon.attrib['id'], el.attrib['ref']), level=1)
-                    else:
-                        ways.put(self.way_node_ids(way))
-            ways_a, ways_b = {}, {}
-            while not ways.empty():
-                way = ways.get(block=False)
-                if way[0] == way[-1]:
-                    out.append(self.way_coordinates_for_ids(way))
-                else:
-                    if way[-1] < way[0]:
-                        way.reverse()
-                    a, b = way[0], way[-1]
-                    if a in ways_b:
-                        other = ways_b.pop(a)
-                        ways_a.pop(other[0])
-                        ways.put(other + way[1:])
-                    elif a in ways_a:
-                        other = ways_a.pop(a)
-                        ways_b.pop(other[-1])
-                        ways.put(other[::-1] + way[1:])
-                    elif b in ways_a:
-                        other = ways_a.pop(b)
-                        ways_b.pop(other[-1])
-                        ways.put(way + other[1:])
-                    elif b in ways_b:
-                        other = ways_b.pop(b)
-                        ways_a.pop(other[0])
-                        ways.put(way[:-1] + other[::-1])
-                    else:
-                        ways_a[a] = way
-                        ways_b[b] = way
-            if len(ways_a) is not 0:
-                nulano_log('multipolygon {} has {} unconnected way(s)'
-                           .format(multipolygon.attrib['id'], len(ways_a)), level=1)
-            return out
+            rings = [ring for role, ring in self.multipolygon_rings(multipolygon)]
+            if len(rings) == 0:
+                return []
+            # look up the nodes of all rings at once
+            coordinates = self.osm_data.nodes.coordinates(np.concatenate(rings)).tolist()
+            ends = list(accumulate(map(len, rings)))
+            return [list(map(tuple, coordinates[end - len(ring):end])) for ring, end in zip(rings, ends)]
         except (KeyError, ValueError):
             from traceback import format_exc
             for line in format_exc(limit=2, chain=False).splitlines():
@@ -0,0 +1,467 @@
+import os
+import re
+import sys
+from array import array
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from io import BytesIO, RawIOBase
+from queue import Queue, Empty
+from threading import Thread
+from typing import Union
+from xml.etree.ElementTree import ElementTree, Element, iterparse
+
+import numpy as np
+
+from node_store import NodeStore, NodeFileWriter, MappedNodeStore
+from tag_store import TagStore
+
+
+# fallback for incompatible gui implementations
+def nulano_log(*msg, level=0):
+    print(*msg)
+
+
+# fallback for incompatible gui implementations
+def nulano_gui_callback(group: str = 'info', status: str = 'unknown', current: Union[int, float] = 0, maximum: int = 0):
+    print('{}: {}/{}, ({})'.format(group, current, maximum, status))
+
+
+_PROGRESS_STEP = 100000
+_NODE_FLUSH = 1 << 20
+_FRAGMENT_SIZE = 1 << 16
+
+_ELEMENT_TYPES = ('node', 'way', 'relation')
+_ELEMENT_START = re.compile(rb'<(?:node|way|relation)[\s/>]')
+
+_CHUNK_SEARCH = 1 << 16
+_CHUNK_MIN = 1 << 20
+_CHUNK_MAX = 1 << 25
+
+_COMPRESSION = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+_DECOMPRESS_CHUNK = 1 << 20
+_DECOMPRESS_QUEUE = 16
+
+
+class OsmElement:
+    """A lightweight stand-in for a tagged xml.etree.ElementTree.Element, geometry is kept in OsmData."""
+    __slots__ = 'tag', 'id', 'tags', '__weakref__'
+
+    def __init__(self, tag: str, id: int, tags: Mapping):
+        self.tag = tag
+        self.id = id
+        self.tags = tags
+
+    def get(self, key, default=None):
+        return str(self.id) if key == 'id' else default
+
+    @property
+    def attrib(self):
+        return {'id': str(self.id)}
+
+    def __repr__(self):
+        return '<OsmElement {} {}>'.format(self.tag, self.id)
+
+
+class OsmData:
+    def __init__(self, node_store: str = None):
+        self.bounds = None
+        self.nodes = None
+        # directory for a disk-backed node store, nodes are flushed to it in batches while loading
+        self._node_writer = NodeFileWriter(node_store) if node_store is not None else None
+        self._node_ids = array('q')
+        self._node_lat = array('d')
+        self._node_lon = array('d')
+        self.ways = {}
+        self.relations = {}
+        self.tags = TagStore()
+        self._element_tags = array('b')
+        self._element_ids = array('q')
+        self.elements = []
+
+    def add_nodes(self, ids, lat, lon):
+        self._node_ids.frombytes(np.asarray(ids, dtype=np.int64).tobytes())
+        self._node_lat.frombytes(np.asarray(lat, dtype=np.float64).tobytes())
+        self._node_lon.frombytes(np.asarray(lon, dtype=np.float64).tobytes())
+        self._flush_nodes(_NODE_FLUSH)
+
+    def _flush_nodes(self, minimum: int = 0):
+        if self._node_writer is not None and len(self._node_ids) > minimum:
+            self._node_writer.write(np.frombuffer(self._node_ids, dtype=np.int64),
+                                    np.frombuffer(self._node_lat, dtype=np.float64),
+                                    np.frombuffer(self._node_lon, dtype=np.float64))
+            self._node_ids, self._node_lat, self._node_lon = array('q'), array('d'), array('d')
+
+    def add_way(self, id: int, refs, tags: dict):
+        self.ways[id] = refs
+        self.add_tags('way', id, tags)
+
+    def add_relation(self, id: int, members: list, tags: dict):
+        self.relations[id] = members
+        self.add_tags('relation', id, tags)
+
+    def add_tags(self, tag: str, id: int, tags: dict):
+        if len(tags) != 0:
+            self._element_tags.append(_ELEMENT_TYPES.index(tag))
+            self._element_ids.append(id)
+            self.tags.add(tags)
+
+    def add(self, element: Element):
+        tag = element.tag
+        if tag == 'bounds':
+            self.bounds = tuple(float(element.get(k)) for k in ('minlat', 'minlon', 'maxlat', 'maxlon'))
+            return
+        elif tag not in _ELEMENT_TYPES:
+            return
+        id = int(element.get('id'))
+        tags = {el.get('k'): el.get('v') for el in element.findall('tag')}
+        if tag == 'node':
+            self._node_ids.append(id)
+            self._node_lat.append(float(element.get('lat')))
+            self._node_lon.append(float(element.get('lon')))
+            self._flush_nodes(_NODE_FLUSH)
+            self.add_tags(tag, id, tags)
+        elif tag == 'way':
+            self.add_way(id, array('q', [int(nd.get('ref')) for nd in element.findall('nd')]), tags)
+        else:
+            self.add_relation(id, [(member.get('type'), int(member.get('ref')), member.get('role'))
+                                   for member in element.findall('member')], tags)
+
+    def extend(self, other: 'OsmData'):
+        if other.bounds is not None:
+            self.bounds = other.bounds
+        self._node_ids.extend(other._node_ids)
+        self._node_lat.extend(other._node_lat)
+        self._node_lon.extend(other._node_lon)
+        self._flush_nodes(_NODE_FLUSH)
+        self.ways.update(other.ways)
+        self.relations.update(other.relations)
+        self.tags.extend(other.tags)
+        self._element_tags.extend(other._element_tags)
+        self._element_ids.extend(other._element_ids)
+
+    def select(self, node_ids: np.ndarray, way_ids: set, relation_ids: set):
+        """Returns a new OsmData with only the given nodes (a sorted array), ways and relations."""
+        out = OsmData()
+        out.bounds = self.bounds
+        ids = np.frombuffer(self._node_ids, dtype=np.int64)
+        keep = np.isin(ids, node_ids, assume_unique=True)
+        out.add_nodes(ids[keep], np.frombuffer(self._node_lat, dtype=np.float64)[keep],
+                      np.frombuffer(self._node_lon, dtype=np.float64)[keep])
+        out.ways = {id: refs for id, refs in self.ways.items() if id in way_ids}
+        out.relations = {id: members for id, members in self.relations.items() if id in relation_ids}
+
+        tags, ids = np.frombuffer(self._element_tags, dtype=np.int8), np.frombuffer(self._element_ids, dtype=np.int64)
+        keep = np.isin(ids, node_ids) & (tags == 0)
+        for i, (tag, id) in enumerate(zip(tags.tolist(), ids.tolist())):
+            if keep[i] or (tag == 1 and id in way_ids) or (tag == 2 and id in relation_ids):
+                out.add_tags(_ELEMENT_TYPES[tag], id, dict(self.tags[i].items()))
+        return out
+
+    def finish(self):
+        if self._node_writer is not None:
+            self._flush_nodes()
+            self.nodes = self._node_writer.finish()
+            self._node_writer = None
+        else:
+            self.nodes = NodeStore(self._node_ids, self._node_lat, self._node_lon)
+        self.elements = [OsmElement(_ELEMENT_TYPES[tag], id, self.tags[i]) for i, (tag, id) in
+                         enumerate(zip(self._element_tags, self._element_ids))]
+        del self._node_ids, self._node_lat, self._node_lon, self._element_tags, self._element_ids
+        return self
+
+    def prune(self, elements: list):
+        """Keeps only the given elements and the ways and nodes they need."""
+        relations = {element.id for element in elements if element.tag == 'relation'}
+        self.relations = {id: members for id, members in self.relations.items() if id in relations}
+        ways = {element.id for element in elements if element.tag == 'way'}
+        ways.update(ref for members in self.relations.values() for member_type, ref, role in members if member_type == 'way')
+        self.ways = {id: refs for id, refs in self.ways.items() if id in ways}
+
+        # the disk-backed store is left to the page cache
+        if not isinstance(self.nodes, MappedNodeStore):
+            nodes = np.unique(np.concatenate([np.array([e.id for e in elements if e.tag == 'node'], dtype=np.int64)] +
+                                             [np.asarray(refs, dtype=np.int64) for refs in self.ways.values()]))
+            keep = np.isin(self.nodes.ids, nodes, assume_unique=True)
+            self.nodes = NodeStore(self.nodes.ids[keep], self.nodes.lat[keep], self.nodes.lon[keep])
+
+        # elements may be referenced elsewhere (e.g. by artists), their tags are moved to a new store in place
+        tags = TagStore()
+        for element in elements:
+            element.tags = tags[tags.add(dict(element.tags.items()))]
+        self.tags = tags
+        self.elements = list(elements)
+
+    def memory_usage(self):
+        """Approximate number of bytes used by the map data."""
+        size = 0
+        if not isinstance(self.nodes, MappedNodeStore):
+            size += self.nodes.ids.nbytes + self.nodes.lat.nbytes + self.nodes.lon.nbytes
+        size += sys.getsizeof(self.ways) + sum(sys.getsizeof(refs) for refs in self.ways.values())
+        size += sys.getsizeof(self.relations) + sum(sys.getsizeof(members) + sum(map(sys.getsizeof, members))
+                                                    for members in self.relations.values())
+        size += sum(map(sys.getsizeof, (self.tags.keys, self.tags.values, self.tags.offsets, self.tags.string_ids)))
+        size += sum(map(sys.getsizeof, self.tags.strings))
+        if len(self.elements) != 0:
+            size += sys.getsizeof(self.elements) + \
+                    len(self.elements) * (sys.getsizeof(self.elements[0]) + sys.getsizeof(self.elements[0].tags))
+        return size
+
+    def to_arrays(self):
+        if isinstance(self.nodes, MappedNodeStore):
+            raise ValueError('maps with a disk-backed node store can not be exported to arrays')
+        way_refs = [np.asarray(refs, dtype=np.int64) for refs in self.ways.values()]
+        members = [member for relation in self.relations.values() for member in relation]
+        # roles share the string table with the tags, intern them before it is exported
+        roles = [self.tags.intern(role) for t, ref, role in members]
+        arrays = self.tags.to_arrays()
+        arrays.update({
+            'bounds': np.array(self.bounds if self.bounds is not None else (), dtype=np.float64),
+            'node_ids': self.nodes.ids,
+            'node_lat': self.nodes.lat,
+            'node_lon': self.nodes.lon,
+            'way_ids': np.fromiter(self.ways.keys(), dtype=np.int64, count=len(self.ways)),
+            'way_offsets': np.cumsum([0] + [len(refs) for refs in way_refs], dtype=np.int64),
+            'way_refs': np.concatenate(way_refs) if len(way_refs) != 0 else np.zeros(0, dtype=np.int64),
+            'relation_ids': np.fromiter(self.relations.keys(), dtype=np.int64, count=len(self.relations)),
+            'relation_offsets': np.cumsum([0] + [len(m) for m in self.relations.values()], dtype=np.int64),
+            'member_types': np.array([_ELEMENT_TYPES.index(t) for t, ref, role in members], dtype=np.int8),
+            'member_refs': np.array([ref for t, ref, role in members], dtype=np.int64),
+            'member_roles': np.array(roles, dtype=np.int32),
+            'element_tags': np.array([_ELEMENT_TYPES.index(e.tag) for e in self.elements], dtype=np.int8),
+            'element_ids': np.array([e.id for e in self.elements], dtype=np.int64),
+        })
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        data = cls()
+        data.tags = TagStore.from_arrays(arrays)
+        strings = data.tags.strings
+
+        bounds = arrays['bounds']
+        data.bounds = tuple(bounds.tolist()) if len(bounds) != 0 else None
+        data._node_ids, data._node_lat, data._node_lon = arrays['node_ids'], arrays['node_lat'], arrays['node_lon']
+
+        way_refs, way_offsets = arrays['way_refs'], arrays['way_offsets'].tolist()
+        data.ways = {id: way_refs[a:b] for id, a, b in zip(arrays['way_ids'].tolist(), way_offsets, way_offsets[1:])}
+
+        members = list(zip([_ELEMENT_TYPES[t] for t in arrays['member_types'].tolist()],
+                           arrays['member_refs'].tolist(),
+                           [strings[r] for r in arrays['member_roles'].tolist()]))
+        offsets = arrays['relation_offsets'].tolist()
+        data.relations = {id: members[a:b] for id, a, b in zip(arrays['relation_ids'].tolist(), offsets, offsets[1:])}
+
+        data._element_tags = arrays['element_tags'].tolist()
+        data._element_ids = arrays['element_ids'].tolist()
+        return data.finish()
+
+
+def read_element_tree(element_tree: ElementTree):
+    data = OsmData()
+    for element in element_tree.getroot():
+        data.add(element)
+    return data.finish()
+
+
+class DecompressingReader(RawIOBase):
+    """Decompresses a .gz/.bz2/.xz file in a background thread, so decompression overlaps with parsing."""
+
+    def __init__(self, file: str):
+        self.raw = open(file, 'rb')
+        self._stream = import_module(_COMPRESSION[os.path.splitext(file)[1]]).open(self.raw)
+        self._chunks = Queue(_DECOMPRESS_QUEUE)
+        self._buffer = b''
+        self._error = None
+        self._eof = False
+        self._closing = False
+        self._thread = Thread(target=self._decompress, name='decompress ' + file, daemon=True)
+        self._thread.start()
+
+    def _decompress(self):
+        try:
+            while not self._closing:
+                chunk = self._stream.read(_DECOMPRESS_CHUNK)
+                self._chunks.put(chunk)
+                if len(chunk) == 0:
+                    break
+        except BaseException as ex:
+            self._error = ex
+            self._chunks.put(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if len(self._buffer) == 0:
+            if self._eof:
+                return 0
+            if self._error is None:
+                self._buffer = self._chunks.get()
+            if self._error is not None:
+                # the decompression thread stopped, report its error on every later read too
+                raise self._error
+            if len(self._buffer) == 0:
+                self._eof = True
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def tell(self):
+        # progress is reported against the size of the compressed file
+        return self.raw.tell()
+
+    def close(self):
+        if not self.closed:
+            self._closing = True
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=0.1)  # unblock the decompression thread
+                except Empty:
+                    pass
+            self._stream.close()
+            self.raw.close()
+        super().close()
+
+
+def open_osm(file: str):
+    if os.path.splitext(file)[1] in _COMPRESSION:
+        return DecompressingReader(file)
+    return open(file, 'rb')
+
+
+def _iter_elements(f, size: int = 0):
+    root = None
+    count = 0
+    for event, element in iterparse(f, events=('start', 'end')):
+        if root is None:
+            root = element
+        elif event == 'end' and element.tag in ('node', 'way', 'relation', 'bounds'):
+            yield element
+            # only direct children of root end here, drop everything parsed so far
+            root.clear()
+            count += 1
+            if size != 0 and count % _PROGRESS_STEP == 0:
+                nulano_gui_callback(group='loading map', status='parsing xml', current=f.tell(), maximum=size)
+
+
+def _parse(f, data: OsmData, size: int = 0):
+    for element in _iter_elements(f, size):
+        data.add(element)
+    return data
+
+
+def _iter_xml(file: str):
+    data = OsmData()
+    with open_osm(file) as f:
+        for element in _iter_elements(f, os.path.getsize(file)):
+            data.add(element)
+            if len(data._node_ids) + len(data.ways) + len(data.relations) >= _FRAGMENT_SIZE:
+                yield data
+                data = OsmData()
+    yield data
+
+
+def _parse_chunk(file: str, begin: int, end: int):
+    with open(file, 'rb') as f:
+        f.seek(begin)
+        chunk = f.read(end - begin)
+    return _parse(BytesIO(b'<osm>' + chunk + b'</osm>'), OsmData())
+
+
+def _find_element(f, position: int, end: int):
+    # '<' can not appear unescaped in attribute values, so this only matches element starts
+    f.seek(position)
+    while position < end:
+        window = f.read(_CHUNK_SEARCH)
+        match = _ELEMENT_START.search(window)
+        if match is not None:
+            return min(position + match.start(), end)
+        # keep a few bytes in case the match is split between reads
+        position += max(1, len(window) - 16)
+        f.seek(position)
+    return end
+
+
+def _split(file: str, size: int, chunk_size: int):
+    with open(file, 'rb') as f:
+        f.seek(max(0, size - _CHUNK_SEARCH))
+        tail = f.read()
+        end = tail.rfind(b'</osm>')
+        if end == -1:
+            raise ValueError('{} is truncated, </osm> not found'.format(file))
+        end += size - len(tail)
+        boundaries = [_find_element(f, 0, end)]
+        while boundaries[-1] < end:
+            boundaries.append(_find_element(f, max(boundaries[-1] + 1, boundaries[0] + len(boundaries) * chunk_size), end))
+        f.seek(0)
+        header = f.read(boundaries[0])
+    return header, list(zip(boundaries, boundaries[1:]))
+
+
+def _iter_xml_parallel(file: str, processes: int = None, chunk_size: int = None):
+    size = os.path.getsize(file)
+    if chunk_size is None:
+        chunk_size = max(_CHUNK_MIN, min(_CHUNK_MAX, size // (4 * (processes or os.cpu_count() or 1))))
+    header, chunks = _split(file, size, chunk_size)
+
+    # the header is everything before the first element, i.e. the xml declaration, <osm> and <bounds>
+    yield _parse(BytesIO(header + b'</osm>'), OsmData())
+    with ProcessPoolExecutor(processes) as pool:
+        # keep a bounded number of chunks in flight, results are yielded in file order
+        pending = deque()
+        limit = 2 * (processes or os.cpu_count() or 1)
+        done = 0
+        for begin, end in chunks:
+            pending.append(pool.submit(_parse_chunk, file, begin, end))
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+                done += 1
+                nulano_gui_callback(group='loading map', status='parsing xml', current=done, maximum=len(chunks))
+        while len(pending) != 0:
+            yield pending.popleft().result()
+            done += 1
+            nulano_gui_callback(group='loading map', status='parsing xml', current=done, maximum=len(chunks))
+
+
+def load_osm_parallel(file: str, processes: int = None, chunk_size: int = None, node_store: str = None):
+    data = OsmData(node_store)
+    for fragment in _iter_xml_parallel(file, processes, chunk_size):
+        data.extend(fragment)
+    return data
+
+
+def iter_fragments(file: str, processes: int = None):
+    """Yields the map as a sequence of OsmData fragments in file order, without keeping all of them in memory."""
+    if file.endswith('.pbf'):
+        from osm_pbf import iter_pbf
+        yield from iter_pbf(file, processes)
+    elif processes is not None and processes > 1 and os.path.splitext(file)[1] not in _COMPRESSION:
+        yield from _iter_xml_parallel(file, processes)
+    else:
+        yield from _iter_xml(file)
+
+
+def load_osm(file: str, processes: int = None, node_store: str = None, bbox: tuple = None):
+    if bbox is not None:
+        from osm_extract import load_osm_bbox
+        return load_osm_bbox(file, bbox, processes, node_store)
+    if file.endswith('.pbf'):
+        from osm_pbf import load_pbf
+        return load_pbf(file, processes, node_store)
+
+    compressed = os.path.splitext(file)[1] in _COMPRESSION
+    if processes is not None and processes > 1 and not compressed:
+        data = load_osm_parallel(file, processes, node_store=node_store)
+    else:
+        if processes is not None and processes > 1:
+            nulano_log('compressed maps can not be split, parsing with a single process', level=1)
+        with open_osm(file) as f:
+            data = _parse(f, OsmData(node_store), os.path.getsize(file))
+    data.finish()
+    nulano_log('parsed {} nodes, {} ways, {} relations ({} tagged)'
+               .format(len(data.nodes), len(data.ways), len(data.relations), len(data.elements)))
+    return data
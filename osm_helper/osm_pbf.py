@@ -0,0 +1,252 @@
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+import numpy as np
+
+from osm_loader import OsmData, _ELEMENT_TYPES
+
+# https://wiki.openstreetmap.org/wiki/PBF_Format
+
+_SUPPORTED_FEATURES = {'OsmSchema-V0.6', 'DenseNodes'}
+_PROGRESS_STEP = 32
+
+
+# fallback for incompatible gui implementations
+def nulano_log(*msg, level=0):
+    print(*msg)
+
+
+# fallback for incompatible gui implementations
+def nulano_gui_callback(group: str = 'info', status: str = 'unknown', current: Union[int, float] = 0, maximum: int = 0):
+    print('{}: {}/{}, ({})'.format(group, current, maximum, status))
+
+
+def _varint(buf, pos: int):
+    out, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        out |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return out, pos
+        shift += 7
+
+
+def _fields(buf):
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError('unsupported protobuf wire type {}'.format(wire_type))
+        yield field, value
+
+
+def _packed(buf):
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    values = (data & 0x7f).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    # the shifted groups do not overlap, so a sum is the same as a bitwise or
+    return np.add.reduceat(values, starts)
+
+
+def _packed_signed(buf):
+    values = _packed(buf)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def _packed_delta(buf):
+    return np.cumsum(_packed_signed(buf))
+
+
+def _sint(value: int):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _int64(value: int):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _tags(keys, values, strings: list):
+    return {strings[k]: strings[v] for k, v in zip(keys, values)}
+
+
+def _read_blob(blob):
+    raw, zlib_data = None, None
+    for field, value in _fields(blob):
+        if field == 1:
+            raw = value
+        elif field == 3:
+            zlib_data = value
+        elif field in (4, 5, 6, 7):
+            raise ValueError('unsupported PBF blob compression (field {})'.format(field))
+    if raw is not None:
+        return raw
+    return zlib.decompress(zlib_data)
+
+
+def _read_header(block):
+    bounds = None
+    for field, value in _fields(block):
+        if field == 1:
+            bbox = {f: _sint(v) for f, v in _fields(value)}
+            # left, right, top, bottom in nanodegrees
+            bounds = bbox[4] / 1e9, bbox[1] / 1e9, bbox[3] / 1e9, bbox[2] / 1e9
+        elif field == 4:
+            feature = bytes(value).decode('utf-8')
+            if feature not in _SUPPORTED_FEATURES:
+                raise ValueError('unsupported PBF feature: {}'.format(feature))
+    return bounds
+
+
+def _decode_block(blob: bytes):
+    block = memoryview(_read_blob(memoryview(blob)))
+    strings, groups = [], []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, value in _fields(block):
+        if field == 1:
+            strings = [bytes(s).decode('utf-8') for f, s in _fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = _int64(value)
+        elif field == 20:
+            lon_offset = _int64(value)
+
+    data = OsmData()
+
+    def add_nodes(ids, lat, lon):
+        data.add_nodes(ids, (lat_offset + granularity * lat) / 1e9, (lon_offset + granularity * lon) / 1e9)
+
+    for group in groups:
+        for field, value in _fields(group):
+            if field == 1:
+                node = {1: 0, 8: 0, 9: 0}
+                keys, values = (), ()
+                for f, v in _fields(value):
+                    if f == 2:
+                        keys = _packed(v).tolist()
+                    elif f == 3:
+                        values = _packed(v).tolist()
+                    elif f in node:
+                        node[f] = _sint(v)
+                add_nodes(np.array([node[1]]), np.array([node[8]]), np.array([node[9]]))
+                if len(keys) != 0:
+                    data.add_tags('node', node[1], _tags(keys, values, strings))
+            elif field == 2:
+                ids, lat, lon, keys_vals = (np.zeros(0, dtype=np.int64),) * 3 + (None,)
+                for f, v in _fields(value):
+                    if f == 1:
+                        ids = _packed_delta(v)
+                    elif f == 8:
+                        lat = _packed_delta(v)
+                    elif f == 9:
+                        lon = _packed_delta(v)
+                    elif f == 10:
+                        keys_vals = _packed(v)
+                add_nodes(ids, lat, lon)
+                if keys_vals is not None:
+                    # keys and values of each node are terminated by a 0
+                    ends = np.flatnonzero(keys_vals == 0)
+                    starts = np.concatenate(([0], ends[:-1] + 1))
+                    keys_vals = keys_vals.tolist()
+                    for id, start, end in zip(ids.tolist(), starts.tolist(), ends.tolist()):
+                        if start != end:
+                            data.add_tags('node', id, _tags(keys_vals[start:end:2], keys_vals[start + 1:end:2], strings))
+            elif field == 3:
+                id, keys, values, refs = 0, (), (), np.zeros(0, dtype=np.int64)
+                for f, v in _fields(value):
+                    if f == 1:
+                        id = _int64(v)
+                    elif f == 2:
+                        keys = _packed(v).tolist()
+                    elif f == 3:
+                        values = _packed(v).tolist()
+                    elif f == 8:
+                        refs = _packed_delta(v)
+                data.add_way(id, refs, _tags(keys, values, strings))
+            elif field == 4:
+                id, keys, values, roles, refs, types = 0, (), (), (), (), ()
+                for f, v in _fields(value):
+                    if f == 1:
+                        id = _int64(v)
+                    elif f == 2:
+                        keys = _packed(v).tolist()
+                    elif f == 3:
+                        values = _packed(v).tolist()
+                    elif f == 8:
+                        roles = _packed(v).tolist()
+                    elif f == 9:
+                        refs = _packed_delta(v).tolist()
+                    elif f == 10:
+                        types = _packed(v).tolist()
+                members = [(_ELEMENT_TYPES[t], ref, strings[role]) for t, ref, role in zip(types, refs, roles)]
+                data.add_relation(id, members, _tags(keys, values, strings))
+    return data
+
+
+def _read_blobs(f):
+    while True:
+        size = f.read(4)
+        if len(size) == 0:
+            return
+        header = f.read(struct.unpack('>I', size)[0])
+        blob_type, blob_size = None, 0
+        for field, value in _fields(header):
+            if field == 1:
+                blob_type = bytes(value).decode('utf-8')
+            elif field == 3:
+                blob_size = value
+        yield blob_type, f.read(blob_size)
+
+
+def iter_pbf(file: str, processes: int = None):
+    size = os.path.getsize(file)
+    with open(file, 'rb') as f, ProcessPoolExecutor(processes) as pool:
+        # keep a bounded number of blocks in flight, results are yielded in file order
+        pending = deque()
+        limit = 2 * (processes or os.cpu_count() or 1)
+        count = 0
+        for blob_type, blob in _read_blobs(f):
+            if blob_type == 'OSMHeader':
+                header = OsmData()
+                header.bounds = _read_header(_read_blob(memoryview(blob)))
+                yield header
+            elif blob_type == 'OSMData':
+                pending.append(pool.submit(_decode_block, blob))
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+                    count += 1
+                    if count % _PROGRESS_STEP == 0:
+                        nulano_gui_callback(group='loading map', status='decoding pbf', current=f.tell(), maximum=size)
+        while len(pending) != 0:
+            yield pending.popleft().result()
+
+
+def load_pbf(file: str, processes: int = None, node_store: str = None):
+    data = OsmData(node_store)
+    for fragment in iter_pbf(file, processes):
+        data.extend(fragment)
+    data.finish()
+    nulano_log('decoded {} nodes, {} ways, {} relations ({} tagged)'
+               .format(len(data.nodes), len(data.ways), len(data.relations), len(data.elements)))
+    return data
@@ -0,0 +1,95 @@
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class TagStore:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.keys = array('i')
+        self.values = array('i')
+        self.offsets = array('q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int):
+        return Tags(self, index)
+
+    def intern(self, string: str):
+        try:
+            return self.string_ids[string]
+        except KeyError:
+            self.string_ids[string] = id = len(self.strings)
+            self.strings.append(string)
+            return id
+
+    def add(self, tags: dict):
+        for key, value in tags.items():
+            self.keys.append(self.intern(key))
+            self.values.append(self.intern(value))
+        self.offsets.append(len(self.keys))
+        return len(self.offsets) - 2
+
+    def extend(self, other: 'TagStore'):
+        remap = np.array([self.intern(string) for string in other.strings] or [0], dtype=np.intc)
+        offsets = np.asarray(other.offsets, dtype=np.int64)[1:] + len(self.keys)
+        self.keys.frombytes(remap.take(np.asarray(other.keys, dtype=np.intp)).tobytes())
+        self.values.frombytes(remap.take(np.asarray(other.values, dtype=np.intp)).tobytes())
+        self.offsets.frombytes(offsets.tobytes())
+
+    def to_arrays(self):
+        # XML can not contain NUL characters, so it is safe to use as a separator
+        return {
+            'strings': np.frombuffer('\0'.join(self.strings).encode('utf-8'), dtype=np.uint8),
+            'tag_keys': np.asarray(self.keys, dtype=np.int32),
+            'tag_values': np.asarray(self.values, dtype=np.int32),
+            'tag_offsets': np.asarray(self.offsets, dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        store = cls()
+        store.strings = bytes(arrays['strings']).decode('utf-8').split('\0')
+        store.string_ids = {string: id for id, string in enumerate(store.strings)}
+        store.keys = array('i', arrays['tag_keys'].astype(np.intc).tobytes())
+        store.values = array('i', arrays['tag_values'].astype(np.intc).tobytes())
+        store.offsets = array('q', arrays['tag_offsets'].astype(np.int64).tobytes())
+        return store
+
+
+class Tags(Mapping):
+    """Read-only dict-like view of the tags of one element in a TagStore."""
+    __slots__ = 'store', 'start', 'end'
+
+    def __init__(self, store: TagStore, index: int):
+        self.store = store
+        self.start = store.offsets[index]
+        self.end = store.offsets[index + 1]
+
+    def __getitem__(self, key: str):
+        store = self.store
+        id = store.string_ids.get(key)
+        if id is not None:
+            keys = store.keys
+            for i in range(self.start, self.end):
+                if keys[i] == id:
+                    return store.strings[store.values[i]]
+        raise KeyError(key)
+
+    def __iter__(self):
+        strings = self.store.strings
+        return (strings[key] for key in self.store.keys[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def items(self):
+        store, strings = self.store, self.store.strings
+        return [(strings[key], strings[value]) for key, value in
+                zip(store.keys[self.start:self.end], store.values[self.start:self.end])]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
@@ -0,0 +1,153 @@
+import random
+from collections import Counter
+from queue import Queue
+
+import osm_helper
+import osm_loader
+from multipolygon import assemble_rings, assemble_multipolygon
+
+osm_loader.nulano_log = osm_helper.nulano_log = lambda *msg, level=0: None
+
+
+def old_assemble(ways):
+    # the original assembly from multipolygon_to_polygons: a queue of ways, joined two at a time
+    out = []
+    queue = Queue()
+    for way in ways:
+        queue.put(list(way))
+    ways_a, ways_b = {}, {}
+    while not queue.empty():
+        way = queue.get(block=False)
+        if way[0] == way[-1]:
+            out.append(way)
+        else:
+            if way[-1] < way[0]:
+                way.reverse()
+            a, b = way[0], way[-1]
+            if a in ways_b:
+                other = ways_b.pop(a)
+                ways_a.pop(other[0])
+                queue.put(other + way[1:])
+            elif a in ways_a:
+                other = ways_a.pop(a)
+                ways_b.pop(other[-1])
+                queue.put(other[::-1] + way[1:])
+            elif b in ways_a:
+                other = ways_a.pop(b)
+                ways_b.pop(other[-1])
+                queue.put(way + other[1:])
+            elif b in ways_b:
+                other = ways_b.pop(b)
+                ways_a.pop(other[0])
+                queue.put(way[:-1] + other[::-1])
+            else:
+                ways_a[a] = way
+                ways_b[b] = way
+    return out
+
+
+def normalize(ring):
+    # the same ring may start at any node and go either way
+    ring = list(map(int, ring[:-1]))
+    start = ring.index(min(ring))
+    forward = ring[start:] + ring[:start]
+    backward = forward[:1] + forward[:0:-1]
+    return tuple(min(forward, backward))
+
+
+def edges(rings):
+    return Counter(tuple(sorted(map(int, pair))) for ring in rings for pair in zip(ring[:-1], ring[1:]))
+
+
+def check(ways, rings, expected):
+    # a single node is not a ring
+    expected = [ring for ring in expected if len(ring) > 1]
+    if not all(len(ring) > 1 and ring[0] == ring[-1] for ring in rings):
+        return 'not all rings are closed: {}'.format([list(map(int, ring)) for ring in rings])
+    if sorted(map(normalize, rings)) == sorted(map(normalize, expected)):
+        return None
+    # rings sharing nodes can be joined in more than one way, the same edges must be used
+    if edges(rings) != edges(expected):
+        return 'expected rings {}, got {}'.format(sorted(map(normalize, expected)), sorted(map(normalize, rings)))
+    way_edges = edges([list(way) for way in ways])
+    if any(count > way_edges[edge] for edge, count in edges(rings).items()):
+        return 'rings use edges which are not in the ways: {}'.format(sorted(map(normalize, rings)))
+    return None
+
+
+print('testing multipolygon.assemble_rings')
+test_count = 0
+correct_tests = 0
+failure = None
+
+# the multipolygons of the test map
+data = osm_loader.load_osm('testdata/map.osm')
+helper = osm_helper.OsmHelper(data)
+for element in data.elements:
+    if element.tag == 'relation' and element.tags.get('type') == 'multipolygon':
+        members = helper._multipolygon_members(element.id)
+        ways = [way for role, way in members]
+        rings, leftover = assemble_rings(ways)
+        fail = check(ways, rings, old_assemble(ways))
+        if fail is None:
+            # with roles the outer and inner rings are joined separately, the result must not change
+            fail = check(ways, [ring for role, ring in assemble_multipolygon(members)[0]], old_assemble(ways))
+        if fail is None:
+            correct_tests += 1
+        test_count += 1
+        if failure is None and fail is not None:
+            failure = 'for relation {}: {}'.format(element.id, fail)
+
+
+def split(ring, rng: random.Random, reverse: bool = True):
+    # a closed ring cut into ways at random nodes, some of them reversed
+    cuts = sorted(rng.sample(range(1, len(ring) - 1), min(len(ring) - 2, rng.randint(1, 4))))
+    ways = [ring[a:b + 1] for a, b in zip([0] + cuts, cuts + [len(ring) - 1])]
+    return [way[::-1] if reverse and rng.random() < 0.5 else way for way in ways]
+
+
+rng = random.Random(14)
+synthetic = [
+    ('empty', []),
+    ('closed way', [[1, 2, 3, 1]]),
+    ('reversed ways', [[1, 2, 3], [1, 5, 4, 3]]),
+    ('both ways reversed', [[3, 2, 1], [3, 4, 5, 1]]),
+    ('unclosed ring', [[1, 2, 3], [3, 4, 5]]),
+    ('unclosed ring with a closed one', [[1, 2, 3], [3, 4, 5], [6, 7, 8, 6]]),
+    ('single node way', [[1], [1, 2, 3, 1]]),
+    ('two rings sharing an end node', [[1, 2, 3], [3, 4, 1], [1, 5, 6], [6, 7, 1]]),
+    ('two rings sharing an end node, reversed', [[3, 2, 1], [1, 4, 3], [6, 5, 1], [1, 7, 6]]),
+    ('two rings sharing two end nodes', [[1, 2, 3], [3, 4, 1], [1, 5, 3], [3, 6, 1]]),
+    ('three ways between two nodes', [[1, 2, 3], [3, 4, 1], [1, 5, 3]]),
+]
+for i in range(50):
+    # random rings cut into reversed pieces, shuffled, some of them sharing nodes, some left open
+    rings = []
+    for j in range(rng.randint(1, 4)):
+        nodes = rng.sample(range(100 * j + 1, 100 * j + 100), rng.randint(3, 12))
+        if rng.random() < 0.3 and len(rings) != 0:
+            nodes[0] = rings[-1][rng.randrange(len(rings[-1]) - 1)]
+        rings.append(nodes + nodes[:1])
+    ways = [way for ring in rings for way in split(ring, rng)]
+    if rng.random() < 0.3:
+        ways.pop(rng.randrange(len(ways)))
+    rng.shuffle(ways)
+    synthetic.append(('random {}'.format(i), ways))
+
+for name, ways in synthetic:
+    rings, leftover = assemble_rings(ways)
+    fail = check(ways, rings, old_assemble(ways))
+    if fail is None:
+        # every way ends up in exactly one ring or in the leftover
+        used = edges(rings) + edges([list(way) for way in leftover])
+        if used != edges([list(way) for way in ways if len(way) > 1]):
+            fail = 'the rings and the leftover ways do not use each way once'
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for {} {}: {}'.format(name, ways, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
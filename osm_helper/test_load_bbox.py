@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+import numpy as np
+
+import osm_extract
+import osm_helper
+import osm_loader
+from multipolygon import assemble_multipolygon
+
+osm_loader.nulano_log = osm_helper.nulano_log = osm_extract.nulano_log = lambda *msg, level=0: None
+osm_extract.nulano_gui_callback = lambda **kwargs: None
+
+print('testing osm_extract.load_osm_bbox')
+test_count = 0
+correct_tests = 0
+failure = None
+
+
+def check(name, fail):
+    global test_count, correct_tests, failure
+    test_count += 1
+    if fail is None:
+        correct_tests += 1
+    elif failure is None:
+        failure = '{}: {}'.format(name, fail)
+
+
+def expected_selection(data: osm_loader.OsmData, bbox: tuple):
+    # the ways with a node in the box, then the relations with a member in the box until nothing changes
+    min_lat, min_lon, max_lat, max_lon = bbox
+    nodes = data.nodes
+    inside = set(nodes.ids[(min_lat <= nodes.lat) & (nodes.lat <= max_lat) &
+                           (min_lon <= nodes.lon) & (nodes.lon <= max_lon)].tolist())
+    ways = {id for id, refs in data.ways.items() if any(ref in inside for ref in refs)}
+    relations = set()
+    while True:
+        selected = {id for id, members in data.relations.items() if any(
+            (member_type == 'node' and ref in inside) or (member_type == 'way' and ref in ways) or
+            (member_type == 'relation' and ref in relations) for member_type, ref, role in members)}
+        if selected == relations:
+            return ways, relations
+        relations = selected
+
+
+def check_bbox(name: str, file: str, full: osm_loader.OsmData, bbox: tuple):
+    part = osm_loader.load_osm(file, bbox=bbox)
+    ways, relations = expected_selection(full, bbox)
+    fail = None
+    if set(part.relations) != relations:
+        fail = 'expected relations {}, got {}'.format(sorted(relations), sorted(part.relations))
+    elif not ways <= set(part.ways):
+        fail = 'missing ways {}'.format(sorted(ways - set(part.ways)))
+    else:
+        node_ids = set(part.nodes.ids.tolist())
+        incomplete = [id for id, refs in part.ways.items() if not all(ref in node_ids for ref in refs)]
+        if len(incomplete) != 0:
+            fail = 'ways without all of their nodes {}'.format(incomplete[:5])
+    if fail is None:
+        # the multipolygons crossing the border have the same rings as in the whole map
+        full_helper, part_helper = osm_helper.OsmHelper(full), osm_helper.OsmHelper(part)
+        for element in part.elements:
+            if element.tag == 'relation' and element.tags.get('type') == 'multipolygon':
+                expected = assemble_multipolygon(full_helper._multipolygon_members(element.id))
+                result = assemble_multipolygon(part_helper._multipolygon_members(element.id))
+                if len(result[0]) != len(expected[0]) or result[1] != expected[1]:
+                    fail = 'multipolygon {} has {} rings and {} open ways, expected {} and {}'.format(
+                        element.id, len(result[0]), result[1], len(expected[0]), expected[1])
+                    break
+    check(name, fail)
+
+
+# a grid of boxes over the test map, many multipolygons cross their borders
+full = osm_loader.load_osm('testdata/map.osm')
+min_lat, min_lon, max_lat, max_lon = full.bounds
+lats, lons = np.linspace(min_lat, max_lat, 4), np.linspace(min_lon, max_lon, 4)
+for i in range(3):
+    for j in range(3):
+        check_bbox('box {} {}'.format(i, j), 'testdata/map.osm', full, (lats[i], lons[j], lats[i + 1], lons[j + 1]))
+check_bbox('the whole map', 'testdata/map.osm', full, full.bounds)
+check_bbox('outside of the map', 'testdata/map.osm', full, (0, 0, 1, 1))
+
+# relations refering to relations further in the file, and a multipolygon with one way in the box
+synthetic = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="0.5" lon="0.5"/>
+  <node id="2" lat="0.5" lon="5"/>
+  <node id="3" lat="5" lon="5"/>
+  <node id="4" lat="5" lon="0.5"/>
+  <node id="5" lat="9" lon="9"/>
+  <way id="1"><nd ref="1"/><nd ref="2"/></way>
+  <way id="2"><nd ref="2"/><nd ref="3"/><nd ref="4"/></way>
+  <way id="3"><nd ref="4"/><nd ref="1"/></way>
+  <relation id="1"><member type="relation" ref="2" role=""/></relation>
+  <relation id="2"><member type="relation" ref="3" role=""/></relation>
+  <relation id="3"><member type="way" ref="1" role="outer"/><member type="way" ref="2" role="outer"/>
+    <member type="way" ref="3" role="outer"/><tag k="type" v="multipolygon"/></relation>
+  <relation id="4"><member type="node" ref="5" role=""/></relation>
+  <relation id="5"><member type="relation" ref="4" role=""/><member type="relation" ref="6" role=""/></relation>
+  <relation id="6"><member type="node" ref="1" role=""/></relation>
+</osm>
+'''
+with tempfile.TemporaryDirectory() as directory:
+    file = os.path.join(directory, 'synthetic.osm')
+    with open(file, 'w', encoding='utf-8') as f:
+        f.write(synthetic)
+    check_bbox('synthetic', file, osm_loader.load_osm(file), (0, 0, 1, 1))
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
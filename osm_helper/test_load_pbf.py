@@ -0,0 +1,50 @@
+import numpy as np
+
+import osm_loader
+import osm_pbf
+
+osm_loader.nulano_log = osm_pbf.nulano_log = lambda *msg, level=0: None
+
+print('testing osm_pbf.load_pbf')
+test_count = 0
+correct_tests = 0
+failure = None
+
+
+def check(name, fail):
+    global test_count, correct_tests, failure
+    test_count += 1
+    if fail is None:
+        correct_tests += 1
+    elif failure is None:
+        failure = '{}: {}'.format(name, fail)
+
+
+# the same map, converted with osmium (dense nodes, delta coded ways and relation members)
+expected = osm_loader.load_osm('testdata/map.osm')
+for processes in (None, 2):
+    result = osm_pbf.load_pbf('testdata/map.osm.pbf', processes)
+
+    if not np.array_equal(result.nodes.ids, expected.nodes.ids):
+        check('node ids', 'expected {} nodes, got {}'.format(len(expected.nodes), len(result.nodes)))
+    else:
+        error = max(np.abs(result.nodes.lat - expected.nodes.lat).max(),
+                    np.abs(result.nodes.lon - expected.nodes.lon).max())
+        check('node coordinates', None if error < 1e-7 else 'differ by up to {}'.format(error))
+
+    ways = [id for id in expected.ways if list(result.ways.get(id, [])) != list(expected.ways[id])]
+    check('ways', None if len(ways) == 0 and len(result.ways) == len(expected.ways)
+          else 'refs differ for ways {}'.format(ways[:5]))
+
+    relations = [id for id in expected.relations if result.relations.get(id) != expected.relations[id]]
+    check('relations', None if len(relations) == 0 and len(result.relations) == len(expected.relations)
+          else 'members differ for relations {}'.format(relations[:5]))
+
+    expected_tags = {(e.tag, e.id): dict(e.tags.items()) for e in expected.elements}
+    result_tags = {(e.tag, e.id): dict(e.tags.items()) for e in result.elements}
+    differ = [key for key in expected_tags.keys() | result_tags.keys() if expected_tags.get(key) != result_tags.get(key)]
+    check('tags', None if len(differ) == 0 else 'tags differ for {}'.format(sorted(differ)[:5]))
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
@@ -0,0 +1,36 @@
+import osm_helper
+import xml.etree.ElementTree as ET
+import numpy as np
+
+print('testing osm_helper.way_coordinates_array')
+test_count = 0
+correct_tests = 0
+failure = None
+
+element_tree = ET.parse('testdata/map.osm')
+root = element_tree.getroot()
+helper = osm_helper.OsmHelper(element_tree)
+
+with open('testdata/way_coordinates.out', 'r') as f:
+    for element in root:
+        if element.tag == 'way':
+            fail = None
+            result = helper.way_coordinates_array(element)
+            tokens = f.readline().split()
+            expected = np.array([(float(tokens[i]), float(tokens[i+1])) for i in range(0, len(tokens), 2)])
+
+            if not isinstance(result, np.ndarray):
+                fail = 'expected numpy.ndarray, got {}'.format(type(result))
+            elif result.shape != (len(expected), 2):
+                fail = 'expected shape {}, got {}'.format((len(expected), 2), result.shape)
+            elif not np.array_equal(result, expected):
+                fail = 'expected \n{},\n got \n{}\n'.format(expected, result)
+            else:
+                correct_tests += 1
+            test_count += 1
+            if failure is None and fail is not None:
+                failure = 'for way with id={}: {}'.format(element.attrib['id'], fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))
@@ -0,0 +1,116 @@
+import os
+from hashlib import sha1
+from importlib import import_module
+
+import numpy as np
+
+import artists
+from osm_loader import OsmData
+
+_VERSION = 5
+_CHUNK = 1 << 20
+
+
+# fallback for incompatible gui implementations
+def nulano_log(*msg, level=0):
+    print(*msg)
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'osm-map-viewer')
+
+
+def snapshot_path(file: str):
+    name = sha1(os.path.abspath(file).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir(), '{}-{}.npz'.format(os.path.basename(file), name))
+
+
+# modules whose code decides what is stored in a snapshot: the style tables, the artist states (bounding boxes,
+# areas and which elements convert to nothing) and the map data layout
+_SNAPSHOT_MODULES = ['artists', 'base_artist', 'geometry', 'polylabel', 'camera', 'location_filter', 'osm_helper',
+                     'multipolygon', 'osm_loader', 'node_store', 'tag_store']
+
+
+def _code_hash():
+    # any change to these modules must invalidate the snapshot, without bumping _VERSION by hand
+    digest = sha1()
+    for name in _SNAPSHOT_MODULES + getattr(artists, 'files', []):
+        with open(import_module(name).__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def snapshot_key():
+    return '{}:{}'.format(_VERSION, _code_hash())
+
+
+def _content_hash(file: str):
+    digest = sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source(stat: os.stat_result):
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _write(path: str, arrays: dict):
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+    except OSError as ex:
+        nulano_log('could not write map snapshot {}: {}'.format(path, repr(ex)), level=1)
+        return False
+    return True
+
+
+def load_snapshot(file: str, key: str):
+    path = snapshot_path(file)
+    try:
+        with np.load(path) as arrays:
+            # the map is only read again when its size or modification time changed, reading a large extract takes
+            # longer than loading its snapshot
+            stat = os.stat(file)
+            size, mtime_ns = arrays['source'].tolist()
+            touched = stat.st_mtime_ns != mtime_ns
+            if bytes(arrays['key']).decode('utf-8') != key or stat.st_size != size or \
+                    (touched and _content_hash(file) != bytes(arrays['digest']).decode('utf-8')):
+                nulano_log('map snapshot {} is out of date'.format(path))
+                return None
+            osm_data = OsmData.from_arrays(arrays)
+            values, offsets = arrays['state_values'].tolist(), arrays['state_offsets'].tolist()
+            states = [tuple(values[a:b]) for a, b in zip(offsets[:-1], offsets[1:])]
+            pairs = list(zip(arrays['pair_elements'].tolist(), arrays['pair_artists'].tolist(), states))
+            if touched:
+                # the same map with a new modification time, so it is not read again on the next launch
+                arrays = dict(arrays)
+                arrays['source'] = _source(stat)
+                _write(path, arrays)
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, ValueError) as ex:
+        nulano_log('could not read map snapshot {}: {}'.format(path, repr(ex)), level=1)
+        return None
+    nulano_log('loaded map snapshot', path)
+    return osm_data, pairs
+
+
+def save_snapshot(file: str, key: str, osm_data: OsmData, pairs: list):
+    path = snapshot_path(file)
+    elements, artists, states = zip(*pairs) if len(pairs) != 0 else ((), (), ())
+    arrays = osm_data.to_arrays()
+    arrays['key'] = np.frombuffer(key.encode('utf-8'), dtype=np.uint8)
+    arrays['source'] = _source(os.stat(file))
+    arrays['digest'] = np.frombuffer(_content_hash(file).encode('utf-8'), dtype=np.uint8)
+    arrays['pair_elements'] = np.array(elements, dtype=np.int64)
+    arrays['pair_artists'] = np.array(artists, dtype=np.int32)
+    # the artist states are tuples of numbers, stored one after another
+    arrays['state_offsets'] = np.concatenate([[0], np.cumsum([len(state) for state in states])]).astype(np.int64)
+    arrays['state_values'] = np.array([value for state in states for value in state], dtype=np.float64)
+    if _write(path, arrays):
+        nulano_log('saved map snapshot', path)
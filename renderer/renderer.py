@@ -1,18 +1,23 @@
 from collections import defaultdict
 from datetime import timedelta
-from operator import itemgetter
 from time import time
 from typing import Union
 from xml.etree.ElementTree import ElementTree
 
+import numpy as np
 import PIL.Image
 import PIL.ImageDraw
 
 from camera import Camera
 from location_filter import LocationFilter, Rectangle
-from osm_helper import OsmHelper
+from osm_helper import OsmHelper, tag_dict
+from osm_loader import OsmData, load_osm
+import map_cache
 
-from artists import get_artists
+from artists import get_artists, ArtistDispatch
+from base_artist import prefetch_geometry
+
+_PROGRESS_STEP = 10000
 
 
 # fallback for incompatible gui implementations
@@ -26,33 +31,101 @@ def nulano_gui_log(message: str):
 
 
 class Renderer:
-    def __init__(self, camera: Camera, element_tree: ElementTree):
+    def __init__(self, camera: Camera, osm_data: Union[OsmData, ElementTree], pairs: list = None, partial=None,
+                 processes: int = None):
         self.camera = camera
-        self.element_tree = element_tree
-        self.osm_helper = OsmHelper(element_tree)
-
-        for element in element_tree.getroot():
-            if element.tag == 'bounds':
-                self.bounds = Rectangle(float(element.attrib['minlat']), float(element.attrib['minlon']),
-                                        float(element.attrib['maxlat']), float(element.attrib['maxlon']))
-                break
+        self.osm_helper = OsmHelper(osm_data)
+
+        if self.osm_helper.osm_data.bounds is not None:
+            self.bounds = Rectangle(*self.osm_helper.osm_data.bounds)
         else:
-            points = [(float(element.attrib['lat']), float(element.attrib['lon']))
-                      for element in element_tree.getroot() if element.tag == 'node']
-            self.bounds = Rectangle(min(points, key=itemgetter(0))[0], min(points, key=itemgetter(1))[1],
-                                    max(points, key=itemgetter(0))[0], max(points, key=itemgetter(1))[1])
+            self.bounds = Rectangle(*self.osm_helper.osm_data.nodes.bounds())
 
-        draw_pairs = []
         self.artists = get_artists()
-        for i, artist in enumerate(self.artists):
-            nulano_gui_callback(group='loading map', status=str(artist), current=i+1, maximum=len(self.artists))
-            for element in element_tree.getroot():
-                if artist.wants_element(element, osm_helper=self.osm_helper):
+        self.draw_pairs = []
+        # index into self.artists of the artist of each pair
+        self.pair_artists = np.zeros(0, dtype=np.intp)
+        self.filter = LocationFilter(0.1, self.bounds, [], self.osm_helper)
+        # rectangle, zoom level and visible pairs of the last frame, updated incrementally while panning
+        self.view = None
+        if pairs is None:
+            nulano_gui_callback(group='loading map', status='assembling multipolygons', current=1)
+            self.osm_helper.assemble_multipolygons(processes)
+            nulano_gui_callback(group='loading map', status='computing way bounding boxes and areas', current=1)
+            prefetch_geometry(self.osm_helper.elements, self.osm_helper)
+            # cheap preview layers are classified first, so a partial frame can be shown while the rest loads
+            preview = [artist for artist in self.artists if getattr(artist, 'preview', False)]
+            stages = [preview] + [[artist] for artist in self.artists if artist not in preview]
+            stages = [stage for stage in stages if len(stage) != 0]
+            t = time()
+            for i, stage in enumerate(stages):
+                self._classify(stage)
+                if partial is not None and i + 1 < len(stages):
+                    partial(self)
+            t = time() - t
+            elements = len(self.osm_helper.elements)
+            nulano_gui_log('loading: classified {} elements in {}s ({:.0f} elements/s)'
+                           .format(elements, timedelta(seconds=t), elements / max(t, 1e-9)))
+            nulano_gui_callback(group='loading map', status='pruning undrawn elements', current=1)
+            self.osm_helper.prune({element for element, artist in self.draw_pairs})
+        else:
+            nulano_gui_callback(group='loading map', status='restoring snapshot', current=1)
+            elements = self.osm_helper.elements
+            draw_pairs = []
+            for element_index, artist_index, state in pairs:
+                element, artist = elements[element_index], self.artists[artist_index]
+                artist.import_element(element, state, self.osm_helper)
+                draw_pairs += [(element, artist)]
+            self._add_pairs(draw_pairs)
+
+    def _classify(self, artists: list):
+        status = ', '.join(map(str, artists))
+        dispatch = ArtistDispatch(artists)
+        elements = self.osm_helper.elements
+        draw_pairs = []
+        for i, element in enumerate(elements):
+            if i % _PROGRESS_STEP == 0:
+                nulano_gui_callback(group='loading map', status=status, current=i, maximum=len(elements))
+            tags = tag_dict(element)
+            for artist, feature in dispatch.classify(tags):
+                if artist.accept_element(element, feature, tags, self.osm_helper):
                     draw_pairs += [(element, artist)]
+        self._add_pairs(draw_pairs)
+
+    def _add_pairs(self, draw_pairs: list):
+        nulano_gui_callback(group='loading map', status='computing zoom levels', current=1)
+        by_artist = defaultdict(list)
+        for i, (element, artist) in enumerate(draw_pairs):
+            by_artist[artist].append(i)
+        masks = np.zeros(len(draw_pairs), dtype=np.uint32)
+        pair_artists = np.zeros(len(draw_pairs), dtype=np.intp)
+        for artist, indices in by_artist.items():
+            masks[indices] = artist.zoom_masks([draw_pairs[i][0] for i in indices], self.osm_helper)
+            pair_artists[indices] = self.artists.index(artist)
+        nulano_gui_callback(group='loading map', status='updating location filter', current=1)
+        self.draw_pairs += draw_pairs
+        self.pair_artists = np.concatenate([self.pair_artists, pair_artists])
+        self.filter.add(draw_pairs, self.osm_helper, masks)
+        self.view = None
+
+    def _visible(self, rect: Rectangle, zoom: int):
+        # while the zoom level stays, only the pairs entering and leaving the view are looked up
+        if self.view is not None and self.view[1] == zoom:
+            old, _, visible = self.view
+            entering, leaving = self.filter.get_delta(old, rect, zoom)
+            visible[leaving] = False
+            visible[entering] = True
+        else:
+            visible = np.zeros(len(self.draw_pairs), dtype=bool)
+            visible[self.filter.get_indices(rect, zoom)] = True
+        self.view = rect, zoom, visible
+        return visible
 
-        nulano_gui_callback(status='initializing location filter', current=1)
-        self.filter = LocationFilter(0.1, self.bounds, draw_pairs, self.osm_helper)
-        self.zoom_cache = defaultdict(lambda: defaultdict(dict))
+    def export_pairs(self):
+        elements = {element: i for i, element in enumerate(self.osm_helper.elements)}
+        artists = {artist: i for i, artist in enumerate(self.artists)}
+        return [(elements[element], artists[artist], artist.export_element(element))
+                for element, artist in self.draw_pairs]
 
     def center_camera(self):
         self.camera.center_at((self.bounds.min_lat + self.bounds.max_lat)/2,
@@ -65,23 +138,12 @@ class Renderer:
 
         nulano_gui_callback(group='rendering', status='location filter', current=0)
         t = time()
-        pairs = self.filter.get_pairs(self.camera.get_rect())
+        visible = np.flatnonzero(self._visible(self.camera.get_rect(), int(self.camera.zoom_level)))
+        pair_artists = self.pair_artists[visible]
+        for i, artist in enumerate(self.artists):
+            groups[artist] = [self.draw_pairs[j][0] for j in visible[pair_artists == i].tolist()]
         nulano_gui_log('rendering: location filter took {}s'.format(timedelta(seconds=time()-t)))
 
-        nulano_gui_callback(group='rendering', status='zoom filter', current=(0.5/len(self.artists)))
-        t = time()
-        for element, artist in pairs:
-            zoom_filter = self.zoom_cache[artist][element]
-            try:
-                do_draw = zoom_filter[self.camera.zoom_level]
-            except KeyError:
-                zoom_filter[self.camera.zoom_level] = \
-                    artist.draws_at_zoom(element, self.camera.zoom_level, self.osm_helper)
-                do_draw = zoom_filter[self.camera.zoom_level]
-            if do_draw:
-                groups[artist] += [element]
-        nulano_gui_log('rendering: zoom filter took {}s'.format(timedelta(seconds=time()-t)))
-
         for i, artist in enumerate(self.artists):
             nulano_gui_callback(group='rendering', status=str(artist), current=i+1, maximum=len(groups))
             t = time()
@@ -90,3 +152,22 @@ class Renderer:
 
         nulano_gui_callback(group='rendering', status='done', current=len(groups), maximum=len(groups))
         return image
+
+
+def load_map(camera: Camera, file: str, use_cache: bool = True, processes: int = None, partial=None,
+             node_store: str = None, bbox: tuple = None):
+    # snapshots keep all nodes in memory, so they are not used with a disk-backed node store,
+    # and they only hold the whole map
+    if not use_cache or node_store is not None or bbox is not None:
+        return Renderer(camera, load_osm(file, processes, node_store, bbox), partial=partial, processes=processes)
+
+    nulano_gui_callback(group='loading map', status='checking snapshot', current=0)
+    key = map_cache.snapshot_key()
+    snapshot = map_cache.load_snapshot(file, key)
+    if snapshot is not None:
+        return Renderer(camera, *snapshot)
+
+    renderer = Renderer(camera, load_osm(file, processes), partial=partial, processes=processes)
+    nulano_gui_callback(group='loading map', status='saving snapshot', current=1)
+    map_cache.save_snapshot(file, key, renderer.osm_helper.osm_data, renderer.export_pairs())
+    return renderer
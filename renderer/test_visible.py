@@ -0,0 +1,87 @@
+import random
+from types import SimpleNamespace
+
+from camera import Camera
+from location_filter import LocationFilter, Rectangle
+from renderer import Renderer
+
+
+class Dummy:
+    def approx_location(self, obj, trash):
+        return obj
+
+
+def random_box(rng: random.Random):
+    # from buildings to forests, and some points
+    lat, lon = rng.uniform(48, 48.2), rng.uniform(17, 17.3)
+    size = rng.choice((0, 1e-4, 1e-3, 1e-2, 0.1))
+    return Rectangle(lat, lon, lat + rng.uniform(0, size), lon + rng.uniform(0, size))
+
+
+print('testing renderer.Renderer._visible while panning and zooming')
+test_count = 0
+correct_tests = 0
+failure = None
+rng = random.Random(25)
+
+for trial in range(10):
+    count = rng.choice((0, 1, 10, 500, 3000))
+    objects = [[random_box(rng) for k in range(rng.choice((0, 1, 1, 1, 2)))] for j in range(count)]
+    pairs = [(obj, Dummy()) for obj in objects]
+    masks = [rng.getrandbits(16) | 1 << rng.randrange(16) for j in range(count)]
+    # the state Renderer._visible keeps between frames
+    renderer = SimpleNamespace(filter=LocationFilter(0.1, Rectangle(48, 17, 48.3, 17.4), [], None),
+                               draw_pairs=pairs, view=None)
+    renderer.filter.add(pairs, None, masks)
+    camera = Camera(48.1, 17.15, rng.randint(6, 10), (800, 600))
+    fail = None
+    steps = []
+    for step in range(100):
+        kind = rng.random()
+        if kind < 0.6:
+            # drag the map by a few pixels
+            x, y = rng.randint(0, 799), rng.randint(0, 599)
+            point = camera.px_to_gps((x, y))
+            camera.move_point_to_pixel(point, (x + rng.randint(-100, 100), y + rng.randint(-100, 100)))
+            steps.append('pan')
+        elif kind < 0.75:
+            # jump far enough that the old and new view do not overlap
+            old = camera.get_rect()
+            x, y = rng.choice((-1, 2)) * camera.px_width, rng.choice((-1, 2)) * camera.px_height
+            camera.center_at(*camera.px_to_gps((x, y)))
+            new = camera.get_rect()
+            if not (new.min_lat > old.max_lat or old.min_lat > new.max_lat or
+                    new.min_lon > old.max_lon or old.min_lon > new.max_lon):
+                fail = 'the jump to {} overlaps {}'.format(new, old)
+            steps.append('jump')
+        elif kind < 0.8:
+            camera.center_at(rng.uniform(47.9, 48.4), rng.uniform(16.9, 17.5))
+            steps.append('center')
+        elif kind < 0.85:
+            camera.px_width, camera.px_height = rng.randint(1, 1600), rng.randint(1, 1200)
+            steps.append('resize')
+        elif kind < 0.95:
+            camera.zoom_in((rng.randint(0, 799), rng.randint(0, 599)))
+            steps.append('zoom in')
+        else:
+            camera.zoom_out((rng.randint(0, 799), rng.randint(0, 599)))
+            steps.append('zoom out')
+        rect, zoom = camera.get_rect(), int(camera.zoom_level)
+        visible = Renderer._visible(renderer, rect, zoom)
+        expected = renderer.filter.get_indices(rect, zoom).tolist()
+        result = visible.nonzero()[0].tolist()
+        if fail is None and (len(visible) != count or result != expected):
+            missing, extra = set(expected) - set(result), set(result) - set(expected)
+            fail = 'after {}: missing pairs {}, extra pairs {}'.format(', '.join(steps[-5:]), sorted(missing),
+                                                                       sorted(extra))
+        if fail is not None:
+            break
+    if fail is None:
+        correct_tests += 1
+    test_count += 1
+    if failure is None and fail is not None:
+        failure = 'for {} pairs: {}'.format(count, fail)
+
+print('{} out of {} test cases correct.'.format(correct_tests, test_count))
+if failure is not None:
+    print('First failed test: {}'.format(failure))